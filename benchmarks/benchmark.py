@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+"Measure the documents/sec, MB/sec and peak memory of each odt2rst.py stage on synthetic or given odt documents."
+import sys, os, shutil, tempfile, time, getopt, resource, multiprocessing, zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import odt2rst
+import makeodt
+
+
+STAGES = ["unpack", "images", "parse", "transform", "total"]
+
+
+class StageResult:
+    "Timing and memory of one stage run repeat times on one document."
+    def __init__(self, stage, input_path, repeat, elapsed, peak_memory):
+        self.stage = stage
+        self.input_path = input_path
+        self.repeat = repeat
+        self.elapsed = elapsed
+        self.size = getOdtSize(input_path)
+        # Peak resident memory of the process running the stage, in bytes.
+        self.peak_memory = peak_memory
+
+    def getDocumentsPerSecond(self):
+        return self.repeat / max(self.elapsed, 1e-9)
+
+    def getMegabytesPerSecond(self):
+        return self.repeat * self.size / (1024.0 * 1024.0) / max(self.elapsed, 1e-9)
+
+
+def getOdtSize(input_path):
+    "Return the uncompressed size of the odt members, the amount of data the stages go through."
+    odtfile = zipfile.ZipFile(input_path)
+    try:
+        return sum([info.file_size for info in odtfile.infolist()])
+    finally:
+        odtfile.close()
+
+
+def getPeakMemory():
+    "Return the peak resident memory of the current process in bytes."
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak_memory
+    return peak_memory * 1024
+
+
+def resetFolder(folder):
+    if os.path.isdir(folder):
+        shutil.rmtree(folder)
+    os.makedirs(folder)
+
+
+def prepareStageProcess(stage, input_path, work_folder, options, queue):
+    """Unpack the document for the stages following unpack, and synchronize its pictures for the parse and transform stages.
+    Put the odt pictures sizes and the picture dictionary in the queue."""
+    temp_folder = os.path.join(work_folder, "temp")
+    output_folder = os.path.join(work_folder, "output")
+    resetFolder(temp_folder)
+    resetFolder(output_folder)
+
+    odt_pictures_sizes = odt2rst.unpackOdt(input_path, temp_folder, options.referenced_pictures_only, True, options.xml_backend)
+    picture_dict = {}
+    if stage != "images":
+        picture_dict = odt2rst.synchronizeImagesFolders(temp_folder, os.path.join(output_folder, "document.rst"), options.images_relative_folder, odt_pictures_sizes, None, options.use_manifest, options.hash_algorithm, options.hash_jobs, options.image_naming)
+
+    queue.put((odt_pictures_sizes, picture_dict))
+
+
+def runStage(stage, input_path, work_folder, options, odt_pictures_sizes, picture_dict):
+    "Run the stage once. The stages following unpack start from the document prepared by prepareStageProcess."
+    temp_folder = os.path.join(work_folder, "temp")
+    output_folder = os.path.join(work_folder, "output")
+
+    output_path = os.path.join(output_folder, "document.rst")
+    content_path = os.path.join(temp_folder, "content.xml")
+    styles_path = os.path.join(temp_folder, "styles.xml")
+
+    if stage == "total":
+        resetFolder(temp_folder)
+        resetFolder(output_folder)
+        options.temp_folder = temp_folder
+        start = time.time()
+        odt2rst.odt2rst(input_path, output_path, options)
+        return time.time() - start
+
+    if stage == "unpack":
+        resetFolder(temp_folder)
+        start = time.time()
+        odt2rst.unpackOdt(input_path, temp_folder, options.referenced_pictures_only, True, options.xml_backend)
+        return time.time() - start
+
+    if stage == "images":
+        resetFolder(output_folder)
+        start = time.time()
+        odt2rst.synchronizeImagesFolders(temp_folder, output_path, options.images_relative_folder, odt_pictures_sizes, None, options.use_manifest, options.hash_algorithm, options.hash_jobs, options.image_naming)
+        return time.time() - start
+
+    start = time.time()
+    if stage == "parse":
+        odt2rst.parseXml(content_path, options.xml_backend)
+        odt2rst.parseXml(styles_path, options.xml_backend)
+        return time.time() - start
+
+    rst_document = odt2rst.RstDocument(output_path)
+    rst_document.transform(content_path, styles_path, picture_dict, options)
+    return time.time() - start
+
+
+def runStageProcess(stage, input_path, work_folder, repeat, options, prepared, queue):
+    "Run the stage repeat times and put the elapsed time and the peak memory in the queue."
+    odt_pictures_sizes, picture_dict = prepared
+    elapsed = 0.0
+    for i in range(repeat):
+        elapsed += runStage(stage, input_path, work_folder, options, odt_pictures_sizes, picture_dict)
+    queue.put((elapsed, getPeakMemory()))
+
+
+def benchmarkStage(stage, input_path, repeat, options):
+    """Run the stage in a child process so that its peak memory is not hidden by the other stages.
+    The document is prepared for the stage by an other child process so that the peak memory only covers the stage."""
+    work_folder = tempfile.mkdtemp(prefix = "odt2rst-benchmark-")
+    try:
+        queue = multiprocessing.Queue()
+
+        prepared = ({}, {})
+        if stage not in ["unpack", "total"]:
+            process = multiprocessing.Process(target = prepareStageProcess, args = (stage, input_path, work_folder, options, queue))
+            process.start()
+            prepared = queue.get()
+            process.join()
+
+        process = multiprocessing.Process(target = runStageProcess, args = (stage, input_path, work_folder, repeat, options, prepared, queue))
+        process.start()
+        elapsed, peak_memory = queue.get()
+        process.join()
+    finally:
+        shutil.rmtree(work_folder, True)
+
+    return StageResult(stage, input_path, repeat, elapsed, peak_memory)
+
+
+def makeCorpus(corpus_folder, sizes, num_pictures, table_rows):
+    "Generate one synthetic document per size (number of blocks) and return their paths."
+    input_paths = []
+    for num_blocks in sizes:
+        input_path = os.path.join(corpus_folder, "synthetic-%d.odt" % num_blocks)
+        if not os.path.isfile(input_path):
+            makeodt.makeOdt(input_path, num_blocks, num_pictures, 16, table_rows)
+        input_paths.append(input_path)
+    return input_paths
+
+
+def printResults(results):
+    print "%-10s %-28s %8s %10s %10s %10s" % ("stage", "document", "size MB", "docs/sec", "MB/sec", "peak MB")
+    for result in results:
+        size = result.size / (1024.0 * 1024.0)
+        print "%-10s %-28s %8.2f %10.2f %10.2f %10.1f" % (result.stage, os.path.basename(result.input_path)[-28:], size, result.getDocumentsPerSecond(), result.getMegabytesPerSecond(), result.peak_memory / (1024.0 * 1024.0))
+
+
+def help():
+    print "benchmark.py [--sizes n,n,...] [--pictures n] [--table-rows n] [--corpus folder] [--repeat n] [--stages stage,...] [--streaming] [--in-memory] [--no-manifest] [--xml-backend name] [odtfile ...]"
+    print "stages: " + ", ".join(STAGES)
+    print "xml backends: auto, " + ", ".join(sorted(odt2rst.XML_BACKENDS))
+
+
+def main():
+    opts, args = getopt.gnu_getopt(sys.argv[1:], "h", ["help", "sizes=", "pictures=", "table-rows=", "corpus=", "repeat=", "stages=", "streaming", "in-memory", "no-manifest", "xml-backend="])
+
+    options = odt2rst.Options()
+    sizes = [10, 100, 1000]
+    num_pictures = 5
+    table_rows = 4
+    corpus_folder = ""
+    repeat = 3
+    stages = STAGES
+    for o, v in opts:
+        if o in ["-h", "--help"]:
+            help()
+            return
+
+        if o in ["--sizes"]:
+            sizes = [int(size) for size in v.split(",")]
+
+        if o in ["--pictures"]:
+            num_pictures = int(v)
+
+        if o in ["--table-rows"]:
+            table_rows = int(v)
+
+        if o in ["--corpus"]:
+            corpus_folder = v
+
+        if o in ["--repeat"]:
+            repeat = int(v)
+
+        if o in ["--stages"]:
+            stages = v.split(",")
+            for stage in stages:
+                if stage not in STAGES:
+                    print 'Unknown stage: "%s"' % stage
+                    return
+
+        if o in ["--streaming"]:
+            options.streaming = True
+
+        if o in ["--in-memory"]:
+            options.in_memory = True
+
+        if o in ["--no-manifest"]:
+            options.use_manifest = False
+
+        if o in ["--xml-backend"]:
+            try:
+                odt2rst.getXmlBackendName(v)
+            except ValueError, e:
+                print e
+                return
+            options.xml_backend = v
+
+    remove_corpus = False
+    if args:
+        input_paths = args
+    else:
+        if not corpus_folder:
+            corpus_folder = tempfile.mkdtemp(prefix = "odt2rst-corpus-")
+            remove_corpus = True
+        elif not os.path.isdir(corpus_folder):
+            os.makedirs(corpus_folder)
+        input_paths = makeCorpus(corpus_folder, sizes, num_pictures, table_rows)
+
+    try:
+        results = []
+        for input_path in input_paths:
+            for stage in stages:
+                results.append(benchmarkStage(stage, os.path.abspath(input_path), repeat, options))
+        printResults(results)
+    finally:
+        if remove_corpus:
+            shutil.rmtree(corpus_folder, True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+"Build synthetic odt documents exercising the elements odt2rst.py converts."
+import sys, os, zipfile, zlib, struct, random, getopt
+
+
+NAMESPACES = ('xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" '
+    'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0" '
+    'xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0" '
+    'xmlns:draw="urn:oasis:names:tc:opendocument:xmlns:drawing:1.0" '
+    'xmlns:style="urn:oasis:names:tc:opendocument:xmlns:style:1.0" '
+    'xmlns:fo="urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0" '
+    'xmlns:dc="http://purl.org/dc/elements/1.1/" '
+    'xmlns:xlink="http://www.w3.org/1999/xlink"')
+
+STYLES = """<?xml version="1.0" encoding="UTF-8"?>
+<office:document-styles %s><office:styles>
+<style:style style:name="rststyle-textbody" style:family="paragraph"/>
+<style:style style:name="rststyle-strong" style:family="text"><style:text-properties fo:font-weight="bold"/></style:style>
+<style:style style:name="rststyle-emphasis" style:family="text"><style:text-properties fo:font-style="italic"/></style:style>
+<style:style style:name="rststyle-inlineliteral" style:family="text"/>
+<style:style style:name="BoldBase" style:family="text"><style:text-properties fo:font-weight="bold"/></style:style>
+<text:list-style style:name="NumberedList"><text:list-level-style-number text:level="1" style:num-format="1"/><text:list-level-style-number text:level="2" style:num-format="a"/><text:list-level-style-number text:level="3" style:num-format="i"/></text:list-style>
+<text:list-style style:name="rststyle-enumitem"><text:list-level-style-number text:level="1" style:num-format="1"/><text:list-level-style-number text:level="2" style:num-format="1"/><text:list-level-style-number text:level="3" style:num-format="1"/></text:list-style>
+<text:list-style style:name="rststyle-bulletitem"><text:list-level-style-bullet text:level="1"/><text:list-level-style-bullet text:level="2"/><text:list-level-style-bullet text:level="3"/></text:list-style>
+<text:list-style style:name="BulletedList"><text:list-level-style-bullet text:level="1"/><text:list-level-style-bullet text:level="2"/><text:list-level-style-bullet text:level="3"/></text:list-style>
+</office:styles></office:document-styles>""" % NAMESPACES
+
+AUTOMATIC_STYLES = """<office:automatic-styles>
+<style:style style:name="T1" style:family="text"><style:text-properties fo:font-weight="bold"/></style:style>
+<style:style style:name="T2" style:family="text"><style:text-properties fo:font-style="italic"/></style:style>
+<style:style style:name="T3" style:family="text" style:parent-style-name="BoldBase"/>
+<style:style style:name="L1" style:family="paragraph"><style:paragraph-properties fo:margin-left="0.25in"/></style:style>
+<style:style style:name="L2" style:family="paragraph"><style:paragraph-properties fo:margin-left="0.50in"/></style:style>
+</office:automatic-styles>"""
+
+WORDS = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et dolore magna aliqua".split()
+
+
+def makePng(seed, size):
+    "Return the bytes of a size x size png image filled with random pixels."
+    random_generator = random.Random(seed)
+    rows = []
+    for y in range(size):
+        rows.append("\0" + "".join([chr(random_generator.randint(0, 255)) for x in range(size * 3)]))
+
+    def chunk(chunk_type, data):
+        return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data) & 0xffffffff)
+
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)
+    return "\x89PNG\r\n\x1a\n" + chunk("IHDR", header) + chunk("IDAT", zlib.compress("".join(rows))) + chunk("IEND", "")
+
+
+class ContentWriter:
+    "Accumulate the content.xml of a synthetic document made of blocks (heading, paragraphs, images, lists, code, admonitions, section and table)."
+    def __init__(self, seed = 0, table_rows = 4):
+        self.random = random.Random(seed)
+        self.table_rows = table_rows
+        self.fragments = []
+
+    def write(self, text):
+        self.fragments.append(text)
+
+    def getSentence(self, length):
+        return " ".join([self.random.choice(WORDS) for i in range(length)]) + ". "
+
+    def writeParagraph(self, text, style_name = "rststyle-textbody"):
+        self.write('<text:p text:style-name="%s">%s</text:p>' % (style_name, text))
+
+    def writeImages(self, block_index, picture_path):
+        self.writeParagraph('See <draw:frame text:anchor-type="as-char"><draw:image xlink:href="%s"/></draw:frame> inline.' % picture_path)
+        self.writeParagraph('<draw:frame text:anchor-type="paragraph"><draw:image xlink:href="%s"/></draw:frame>' % picture_path)
+        legend = '<text:p text:style-name="rststyle-textbody"><draw:frame text:anchor-type="paragraph"><draw:image xlink:href="%s"/></draw:frame>Legend %d</text:p>' % (picture_path, block_index)
+        self.writeParagraph('<draw:frame text:anchor-type="paragraph"><draw:text-box>%s</draw:text-box></draw:frame>' % legend)
+
+    def writeList(self, list_style_name, sub_list_style_name):
+        self.write('<text:list text:style-name="%s">' % list_style_name)
+        for i in range(3):
+            self.write('<text:list-item><text:p text:style-name="L1">item %d %s</text:p>' % (i, self.getSentence(5)))
+            self.write('<text:list text:style-name="%s">' % sub_list_style_name)
+            self.write('<text:list-item><text:p text:style-name="L2">sub %s</text:p></text:list-item>' % self.getSentence(4))
+            self.write('<text:list-item><text:p text:style-name="L2">sub %s</text:p></text:list-item>' % self.getSentence(2))
+            self.write('</text:list></text:list-item>')
+        self.write('</text:list>')
+
+    def writeTable(self, block_index):
+        self.write('<table:table table:name="Table%d"><table:table-column table:number-columns-repeated="3"/>' % block_index)
+        self.write('<table:table-header-rows><table:table-row>')
+        for column in range(3):
+            self.write('<table:table-cell><text:p>Header %d</text:p></table:table-cell>' % column)
+        self.write('</table:table-row></table:table-header-rows>')
+
+        for row in range(self.table_rows):
+            if row % 4 == 1:
+                self.write('<table:table-row><table:table-cell table:number-columns-spanned="2"><text:p>wide %s</text:p></table:table-cell><table:covered-table-cell/>' % self.getSentence(3))
+                self.write('<table:table-cell table:number-rows-spanned="2"><text:p>tall</text:p></table:table-cell></table:table-row>')
+            elif row % 4 == 2:
+                self.write('<table:table-row><table:table-cell><text:p>a|b</text:p></table:table-cell><table:table-cell><text:p>%s</text:p></table:table-cell><table:covered-table-cell/></table:table-row>' % self.getSentence(2))
+            else:
+                self.write('<table:table-row>')
+                for column in range(3):
+                    self.write('<table:table-cell><text:p>%s</text:p></table:table-cell>' % self.getSentence(1 + column))
+                self.write('</table:table-row>')
+        self.write('</table:table>')
+
+    def writeBlock(self, block_index, picture_paths):
+        self.write('<text:h text:outline-level="%d">Heading %d</text:h>' % (1 + block_index % 3, block_index))
+        spans = '<text:span text:style-name="rststyle-strong">strong</text:span>, <text:span text:style-name="rststyle-emphasis">emphasis</text:span>, '
+        spans += '<text:span text:style-name="T1">bold</text:span>, <text:span text:style-name="T2">italic</text:span>, <text:span text:style-name="T3">inherited</text:span> '
+        spans += 'and <text:span text:style-name="rststyle-inlineliteral">literal()</text:span> '
+        self.writeParagraph(self.getSentence(8) + spans + self.getSentence(12) + self.getSentence(20))
+
+        if picture_paths:
+            self.writeImages(block_index, picture_paths[block_index % len(picture_paths)])
+
+        # The rststyle lists are the ones rst2odt writes, their sub lists use list styles of the document.
+        self.writeList("rststyle-bulletitem", "BulletedList")
+        self.writeList("rststyle-enumitem", "NumberedList")
+
+        self.writeParagraph("Example")
+        self.writeParagraph('def f(x):<text:line-break/><text:s text:c="4"/>return x + 1', "rststyle-codeblock")
+        self.writeParagraph("Note", "rststyle-admon-note-hdr")
+        self.writeParagraph(self.getSentence(10), "rststyle-admon-note-body")
+        self.writeParagraph("Warning", "rststyle-admon-warning-hdr")
+        self.writeParagraph(self.getSentence(6), "rststyle-admon-warning-body")
+        self.writeParagraph("Term")
+        self.writeParagraph(self.getSentence(9), "rststyle-blockindent")
+        self.writeParagraph('commented<office:annotation><dc:date>2010-01-01</dc:date><text:p>a comment</text:p></office:annotation>')
+        self.write('<text:section text:name="Section%d">' % block_index)
+        self.writeParagraph("In a section " + self.getSentence(3))
+        self.write('</text:section>')
+        self.writeTable(block_index)
+
+    def getContent(self, num_blocks, picture_paths):
+        self.fragments = []
+        self.write('<?xml version="1.0" encoding="UTF-8"?>\n<office:document-content %s>' % NAMESPACES)
+        self.write(AUTOMATIC_STYLES)
+        self.write('<office:body><office:text>')
+        self.writeParagraph("Synthetic document", "rststyle-title")
+        for block_index in range(num_blocks):
+            self.writeBlock(block_index, picture_paths)
+        self.write('</office:text></office:body></office:document-content>')
+        return "".join(self.fragments)
+
+
+def makeOdt(output_path, num_blocks = 10, num_pictures = 3, picture_size = 16, table_rows = 4, seed = 0):
+    "Write a synthetic odt document made of num_blocks blocks and num_pictures pictures plus one picture the content does not reference."
+    odtfile = zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED)
+    odtfile.writestr("mimetype", "application/vnd.oasis.opendocument.text")
+
+    picture_paths = []
+    for i in range(num_pictures):
+        picture_path = "Pictures/%08d.png" % i
+        odtfile.writestr(picture_path, makePng(seed * 1000 + i, picture_size + i))
+        picture_paths.append(picture_path)
+    odtfile.writestr("Pictures/unused.png", makePng(seed * 1000 + num_pictures, picture_size))
+
+    content_writer = ContentWriter(seed, table_rows)
+    odtfile.writestr("content.xml", content_writer.getContent(num_blocks, picture_paths))
+    odtfile.writestr("styles.xml", STYLES)
+    odtfile.close()
+
+
+def help():
+    print "makeodt.py [--blocks n] [--pictures n] [--picture-size pixels] [--table-rows n] [--seed n] odtfile"
+
+
+def main():
+    opts, args = getopt.gnu_getopt(sys.argv[1:], "h", ["help", "blocks=", "pictures=", "picture-size=", "table-rows=", "seed="])
+
+    num_blocks = 10
+    num_pictures = 3
+    picture_size = 16
+    table_rows = 4
+    seed = 0
+    for o, v in opts:
+        if o in ["-h", "--help"]:
+            help()
+            return
+
+        if o in ["--blocks"]:
+            num_blocks = int(v)
+
+        if o in ["--pictures"]:
+            num_pictures = int(v)
+
+        if o in ["--picture-size"]:
+            picture_size = int(v)
+
+        if o in ["--table-rows"]:
+            table_rows = int(v)
+
+        if o in ["--seed"]:
+            seed = int(v)
+
+    if len(args) != 1:
+        help()
+        return
+
+    makeOdt(args[0], num_blocks, num_pictures, picture_size, table_rows, seed)
+
+
+if __name__ == "__main__":
+    main()
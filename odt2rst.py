@@ -5,11 +5,72 @@ import shutil
 import zipfile
 import hashlib
 import math
+import array
 import getopt
 import bisect
 import textwrap
+import time
+import copy
+import tempfile
+import multiprocessing
+import multiprocessing.pool
+import functools
+import json
+import cStringIO
+import marshal
+import zlib
+import socket
+import SocketServer
+import threading
+import signal
+import Queue
 import xml.etree.ElementTree
 
+# The ElementTree compatible modules available to parse the xml files, by backend name.
+XML_BACKENDS = {"elementtree": xml.etree.ElementTree}
+
+try:
+    import xml.etree.cElementTree
+    XML_BACKENDS["celementtree"] = xml.etree.cElementTree
+except ImportError:
+    pass
+
+try:
+    import lxml.etree
+    XML_BACKENDS["lxml"] = lxml.etree
+except ImportError:
+    pass
+
+# The backends tried, in order, by the "auto" backend.
+XML_BACKEND_PREFERENCES = ["lxml", "celementtree", "elementtree"]
+
+# The watch mode waits for the file system events instead of polling the folder tree when pyinotify is available.
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+VERSION = "1.0"
+
+
+def getCodeFingerprint():
+    "Return the hash of the converter source code, so that the caches are invalidated by any change of the output without a VERSION change."
+    path = os.path.abspath(__file__)
+    if path.endswith(".pyc") or path.endswith(".pyo"):
+        path = path[:-1]
+
+    try:
+        f = open(path, "rb")
+        try:
+            return hashlib.md5(f.read()).hexdigest()
+        finally:
+            f.close()
+    except IOError:
+        # Frozen or without its source: only the version distinguishes the converters.
+        return VERSION
+
+CODE_FINGERPRINT = getCodeFingerprint()
+
 # Level formats let you choose how you want each heading levels to be translated in the .rst file.
 # It is a list of tuple corresponding to the list of header levels.
 # The first element of the tuple is the charactere used to underline the header.
@@ -18,6 +79,13 @@ LEVEL_FORMATS = [("#", False), ("*", False), ("=", False), ("-", False), ("^", F
 
 DEBUG_FLAG = False
 
+# Lock shared by the batch worker processes so that only one of them synchronizes an images folder at a time.
+IMAGES_LOCK = None
+
+# The images manifests kept loaded between the conversions of the watch mode, by images folder and hash algorithm.
+# None when each conversion reads the manifest file.
+WARM_MANIFESTS = None
+
 office_prefix   =  "{urn:oasis:names:tc:opendocument:xmlns:office:1.0}"
 text_prefix     =  "{urn:oasis:names:tc:opendocument:xmlns:text:1.0}"
 table_prefix    =  "{urn:oasis:names:tc:opendocument:xmlns:table:1.0}"
@@ -27,15 +95,76 @@ fo_prefix       =  "{urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0
 
 xlink_prefix    =  "{http://www.w3.org/1999/xlink}"
 
+# Translate the namespace prefixes into the short prefixes used in the reports.
+short_prefixes = [(office_prefix, "office:"), (text_prefix, "text:"), (table_prefix, "table:"), (drawing_prefix, "draw:"), (style_prefix, "style:"), (fo_prefix, "fo:"), (xlink_prefix, "xlink:")]
+
 
 class Options:
     def __init__(self):
         self.images_relative_folder = "images"
         self.temp_folder = "."
         self.clean = True
+        # Read content.xml, styles.xml and the pictures straight from the odt archive instead of unpacking them in the temp folder.
+        self.in_memory = False
+        # Convert content.xml while it is parsed instead of building its whole tree first.
+        self.streaming = False
+        # Render the tables row by row after a first pass computing the column widths instead of keeping all the cells texts.
+        self.stream_tables = False
+        # Table output: "grid", "list" (list-table directive), "csv" (csv-table directive) or "auto" (list-table for the tables
+        # having at least compact_table_rows rows). The tables with vertical spans are always grid tables.
+        self.table_format = "grid"
+        self.compact_table_rows = 100
         
+        # Keep the hashes of the images folder in a manifest so that only the changed images are hashed again.
+        self.use_manifest = True
+        # Any algorithm of hashlib.new() can be used to compare the pictures.
+        self.hash_algorithm = "md5"
+        # Number of threads hashing the pictures.
+        self.hash_jobs = 4
+        # Name the pictures copied into the images folder "sequential"ly (picture_0, picture_1...) or by the "hash" of their content.
+        # The hash naming needs neither the images folder listing nor the manifest: a picture is copied unless its name exists.
+        self.image_naming = "sequential"
+        # Only extract, hash and copy the pictures content.xml refers to, the pictures left behind by editing are ignored.
+        self.referenced_pictures_only = True
+        # Path of the build cache used to skip the unchanged documents, no cache when empty.
+        self.cache_path = ""
+        # Folder keeping the parsed document models so that a document is rendered again without being parsed, no model cache when empty.
+        self.model_cache_path = ""
+        # Size, in bytes, above which the least recently used models are removed.
+        self.model_cache_size = 256 * 1024 * 1024
+
         self.wrap_width = -1
 
+        # Number of characters collected before they are encoded and written into the rst file (0 to write each fragment at once).
+        self.buffer_size = 64 * 1024
+
+        # Path of the json file receiving the time spent and the bytes processed by each conversion stage, no profile when empty.
+        self.profile_path = ""
+
+        # The xml parser: "auto" (the fastest available), "lxml", "celementtree" or "elementtree".
+        self.xml_backend = "auto"
+        # Count the elements converted by each handler, by tag and style name, and time the handlers.
+        self.element_stats = False
+
+
+# The values allowed for the enumerated Options fields.
+OPTION_CHOICES = {"table_format": ["grid", "list", "csv", "auto"], "image_naming": ["sequential", "hash"]}
+
+
+def checkOptionValue(name, value):
+    "Raise ValueError when the value is not allowed for the Options field, whether it comes from the command line, a variant or a server job."
+    if name in OPTION_CHOICES and value not in OPTION_CHOICES[name]:
+        raise ValueError('Unknown %s: "%s"' % (name.replace("_", " "), value))
+
+    if name == "hash_algorithm":
+        try:
+            hashlib.new(value)
+        except (ValueError, TypeError):
+            raise ValueError('Unknown hash algorithm: "%s"' % value)
+
+    if name == "xml_backend":
+        getXmlBackendName(value)
+
 
 def getRomanString(n):
     values = [
@@ -63,8 +192,33 @@ def getRomanString(n):
     return ret
 
 
-def unpackOdt(input_path, temp_folder = "."):
-    "Unpack the odt file into the temp folder and return a dictionary translating .png file path into they hashes."
+def findHrefs(f, xml_backend = "auto"):
+    """Return the set of the href attribute values of the draw:image elements of the xml file object.
+    Each element is removed from its parent once parsed so that only the elements being parsed are kept in memory."""
+    hrefs = set()
+    # The elements started and not ended yet, from the root.
+    parents = []
+    for event, element in iterparseXml(f, ("start", "end"), xml_backend):
+        if event == "start":
+            parents.append(element)
+            continue
+
+        parents.pop()
+        if element.tag == drawing_prefix + "image":
+            href = element.get(xlink_prefix + "href", None)
+            if href is not None:
+                hrefs.add(href)
+
+        # The parent has no other child left: the removal is immediate.
+        if parents:
+            parents[-1].remove(element)
+
+    return hrefs
+
+
+def unpackOdt(input_path, temp_folder = ".", referenced_pictures_only = False, unpack_pictures = True, xml_backend = "auto"):
+    """Unpack the odt file into the temp folder and return a dictionary translating .png file path into their sizes. Only the pictures content.xml refers to are unpacked when referenced_pictures_only is True.
+    The pictures are only listed, and left in the archive, when unpack_pictures is False."""
     odtfile = zipfile.ZipFile(input_path)
 
     try:
@@ -77,28 +231,99 @@ def unpackOdt(input_path, temp_folder = "."):
     except:
         pass
 
-    odt_pictures_hashes = {}
-    for path in odtfile.namelist():
+    for info in odtfile.infolist():
+        path = info.filename
         if path.lower() in ["content.xml", "styles.xml"]:
+            f = odtfile.open(path)
             g = open(os.path.join(temp_folder, path), "wb")
-            bytes = odtfile.read(path)
-            g.write(bytes)
+            shutil.copyfileobj(f, g, HASH_CHUNK_SIZE)
             g.close()
+            f.close()
 
-        folder, name = os.path.split(path)
-        name, ext = os.path.splitext(name)
-        if folder.lower() == "Pictures".lower() and ext in [".png", ".jpg"]:
-            g = open(os.path.join(temp_folder, path), "wb")
-            bytes = odtfile.read(path)
-            g.write(bytes)
-            g.close()
+    hrefs = None
+    content_path = os.path.join(temp_folder, "content.xml")
+    if referenced_pictures_only and os.path.isfile(content_path) and hasOdtPictures(odtfile):
+        f = open(content_path, "rb")
+        hrefs = findHrefs(f, xml_backend)
+        f.close()
+
+    odt_pictures_sizes = {}
+    for info in odtfile.infolist():
+        path = info.filename
+        if not isOdtPicture(path) or (hrefs is not None and path not in hrefs):
+            continue
+
+        odt_pictures_sizes[path] = info.file_size
+        if not unpack_pictures:
+            continue
+
+        # The picture previously unpacked may be hard linked from an images folder: it is replaced instead of overwritten.
+        picture_path = os.path.join(temp_folder, path)
+        if os.path.exists(picture_path):
+            os.remove(picture_path)
+
+        f = odtfile.open(path)
+        g = open(picture_path, "wb")
+        shutil.copyfileobj(f, g, HASH_CHUNK_SIZE)
+        g.close()
+        f.close()
+
+    odtfile.close()
+
+    return odt_pictures_sizes
+
+
+def isOdtPicture(path):
+    folder, name = os.path.split(path)
+    name, ext = os.path.splitext(name)
+    return folder.lower() == "Pictures".lower() and ext in [".png", ".jpg"]
+
+
+def findOdtMember(odtfile, name):
+    "Return the path of the member of the odt archive matching name (case insensitive) or None."
+    for path in odtfile.namelist():
+        if path.lower() == name:
+            return path
+    return None
+
+
+def hasOdtPictures(odtfile):
+    for path in odtfile.namelist():
+        if isOdtPicture(path):
+            return True
+    return False
+
+
+def findOdtPictureReferences(odtfile, xml_backend = "auto"):
+    "Return the set of the hrefs of the content.xml of the odt archive, None when there is no content.xml. The content is not scanned when the archive has no picture."
+    content_path = findOdtMember(odtfile, "content.xml")
+    if not content_path:
+        return None
+
+    if not hasOdtPictures(odtfile):
+        return set()
+
+    f = odtfile.open(content_path)
+    try:
+        return findHrefs(f, xml_backend)
+    finally:
+        f.close()
+
+
+def readOdt(input_path, referenced_pictures_only = False, xml_backend = "auto"):
+    "Open the odt file without unpacking it and return the archive and a dictionary translating .png file path into their sizes. Only the pictures content.xml refers to are listed when referenced_pictures_only is True."
+    odtfile = zipfile.ZipFile(input_path)
 
-            h = hashlib.md5()
-            h.update(bytes)
-            h = h.digest()
-            odt_pictures_hashes[path] = h
+    hrefs = None
+    if referenced_pictures_only:
+        hrefs = findOdtPictureReferences(odtfile, xml_backend)
 
-    return odt_pictures_hashes
+    odt_pictures_sizes = {}
+    for info in odtfile.infolist():
+        if isOdtPicture(info.filename) and (hrefs is None or info.filename in hrefs):
+            odt_pictures_sizes[info.filename] = info.file_size
+
+    return odtfile, odt_pictures_sizes
 
 
 def cleanPack(temp_folder = "."):
@@ -108,43 +333,355 @@ def cleanPack(temp_folder = "."):
     shutil.rmtree(os.path.join(temp_folder, "Pictures"))
 
 
-def getHashesRstImages(output_folder, images_relative_folder):
-    "Return a dictonary translating hash into the its .png file path."
-    hashes_rst_images = {}
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class HashingReader:
+    "Read a file object updating the hash of the data read so that a file can be hashed while it is copied."
+    def __init__(self, file, algorithm = "md5"):
+        self.file = file
+        self.hash = hashlib.new(algorithm)
+
+    def read(self, size = -1):
+        data = self.file.read(size)
+        self.hash.update(data)
+        return data
+
+    def digest(self):
+        return self.hash.digest()
+
+
+def hashFile(f, algorithm = "md5"):
+    "Return the hash of the file object, read by chunks so that a big picture is never held in memory, and close it."
+    h = hashlib.new(algorithm)
+    chunk = f.read(HASH_CHUNK_SIZE)
+    while chunk:
+        h.update(chunk)
+        chunk = f.read(HASH_CHUNK_SIZE)
+    f.close()
+
+    return h.digest()
+
+
+def hashFiles(openers, algorithm = "md5", jobs = 1):
+    "Return a dictionary translating the keys of openers into the hash of the file object returned by its opener. The files are hashed by a pool of jobs threads."
+    def hashOpener(key):
+        return key, hashFile(openers[key](), algorithm)
+
+    if jobs <= 1 or len(openers) <= 1:
+        return dict(map(hashOpener, openers))
+
+    pool = multiprocessing.pool.ThreadPool(min(jobs, len(openers)))
+    try:
+        return dict(pool.map(hashOpener, list(openers)))
+    finally:
+        pool.close()
+        pool.join()
+
+
+MANIFEST_NAME = ".odt2rst-manifest"
+MANIFEST_HEADER = "odt2rst-manifest 1 "
+
+
+def getFileSignature(path):
+    "Return the (size, mtime) tuple of the file or None when it does not exist."
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    return stat.st_size, stat.st_mtime
+
+
+class ImagesManifest:
+    "Sidecar file of an images folder keeping the size, mtime and hash of each image so that an image is only hashed again when it changed."
+    def __init__(self, image_folder, algorithm = "md5"):
+        self.image_folder = image_folder
+        self.path = os.path.join(image_folder, MANIFEST_NAME)
+        self.algorithm = algorithm
+
+        # Translate an image name into a (size, mtime, hash) tuple. The hash is None for the images that did not need to be hashed yet.
+        self.entries = {}
+        self.modified = False
+        # Signature of the manifest file when it was last read or written.
+        self.signature = None
+
+    def load(self):
+        "Read the manifest. A missing or corrupt manifest is rebuilt from scratch."
+        self.entries = {}
+        self.modified = False
+        self.signature = getFileSignature(self.path)
+
+        if not os.path.isfile(self.path):
+            return
+
+        f = open(self.path, "rb")
+        lines = f.read().splitlines()
+        f.close()
+
+        try:
+            if not lines or lines[0] != MANIFEST_HEADER + self.algorithm:
+                raise ValueError("unknown manifest header")
+
+            for line in lines[1:]:
+                name, size, mtime, h = line.split("\t")
+                self.entries[name] = (int(size), float(mtime), h.decode("hex") or None)
+
+        except (ValueError, TypeError):
+            self.entries = {}
+            self.modified = True
+
+    def save(self):
+        if not self.modified:
+            return
+
+        lines = [MANIFEST_HEADER + self.algorithm]
+        for name in sorted(self.entries):
+            size, mtime, h = self.entries[name]
+            lines.append("%s\t%d\t%r\t%s" % (name, size, mtime, (h or "").encode("hex")))
+
+        # Write a temp file first so that an interrupted run never leaves a truncated manifest.
+        temp_path = self.path + ".tmp"
+        f = open(temp_path, "wb")
+        f.write("\n".join(lines) + "\n")
+        f.close()
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(temp_path, self.path)
+
+        self.modified = False
+        self.signature = getFileSignature(self.path)
+
+    def isCurrent(self):
+        "Return True when the manifest file has not been written by an other process since it was read or written."
+        return self.signature == getFileSignature(self.path)
+
+    def getHash(self, name, stat):
+        "Return the recorded hash of the image or None when it is unknown or the image changed since (size or mtime)."
+        entry = self.entries.get(name, None)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime:
+            return entry[2]
+
+        return None
+
+    def update(self, name, stat):
+        "Record the size and mtime of the image, forgetting its hash when it changed."
+        entry = self.entries.get(name, None)
+        if not entry or entry[0] != stat.st_size or entry[1] != stat.st_mtime:
+            self.setHash(name, None, stat)
+
+    def setHash(self, name, h, stat = None):
+        "Record the hash of an image, h may be None when the image has not been hashed."
+        if "\t" in name or "\n" in name:
+            return
+
+        if stat is None:
+            stat = os.stat(os.path.join(self.image_folder, name))
+
+        self.entries[name] = (stat.st_size, stat.st_mtime, h)
+        self.modified = True
+
+    def keepOnly(self, names):
+        "Forget the images which are not in names anymore."
+        for name in self.entries.keys():
+            if name not in names:
+                del self.entries[name]
+                self.modified = True
+
 
+def getImagesManifest(image_folder, algorithm = "md5"):
+    "Return the loaded manifest of the images folder. In the watch mode the manifest of the previous conversion is kept unless its file changed since."
+    if WARM_MANIFESTS is None:
+        manifest = ImagesManifest(image_folder, algorithm)
+        manifest.load()
+        return manifest
+
+    key = (os.path.abspath(image_folder), algorithm)
+    manifest = WARM_MANIFESTS.get(key, None)
+    if manifest is None or not manifest.isCurrent():
+        manifest = ImagesManifest(image_folder, algorithm)
+        manifest.load()
+        WARM_MANIFESTS[key] = manifest
+
+    return manifest
+
+
+def getHashesRstImages(output_folder, images_relative_folder, manifest = None, sizes = None, algorithm = "md5", jobs = 1):
+    "Return a dictonary translating hash into the its .png file path. When sizes is given only the images having one of those sizes are hashed (no other image can match). The hashes are taken from the manifest when they are up to date."
     image_folder = os.path.join(output_folder, images_relative_folder)
 
     if not os.path.isdir(image_folder):
         return {}
 
+    all_names = set()
+    names = []
+    stats = {}
+    hashes = {}
     for path in os.listdir(image_folder):
         name, ext = os.path.splitext(path)
         if ext not in [".png", ".jpg"]:
             continue
 
-        path = os.path.join(images_relative_folder, path)
+        all_names.add(path)
+        stat = os.stat(os.path.join(image_folder, path))
+        if manifest:
+            manifest.update(path, stat)
 
-        f = open(path, "rb")
-        bytes = f.read()
-        f.close()
+        if sizes is not None and stat.st_size not in sizes:
+            continue
+
+        names.append(path)
+        stats[path] = stat
+        if manifest:
+            hashes[path] = manifest.getHash(path, stat)
 
-        h = hashlib.md5()
-        h.update(bytes)
-        h = h.digest()
-        hashes_rst_images[h] = path
+    openers = {}
+    for path in names:
+        if hashes.get(path, None) is None:
+            openers[path] = functools.partial(open, os.path.join(image_folder, path), "rb")
+
+    new_hashes = hashFiles(openers, algorithm, jobs)
+    hashes.update(new_hashes)
+
+    if manifest:
+        for path in new_hashes:
+            manifest.setHash(path, new_hashes[path], stats[path])
+        manifest.keepOnly(all_names)
+
+    hashes_rst_images = {}
+    for path in names:
+        hashes_rst_images[hashes[path]] = os.path.join(images_relative_folder, path)
 
     return hashes_rst_images
 
 
-def synchronizeImagesFolders(temp_folder, output_path, images_relative_folder, odt_pictures_hashes):
+def copyOdtPicture(path, temp_folder, odtfile, destination_path, hash_algorithm = None):
+    """Copy the odt picture from the odt archive when odtfile is given and from the temp folder otherwise.
+    The archive member is streamed into the destination and, with a hash_algorithm, hashed in the same pass: its hash is returned.
+    The unpacked picture is hard linked when possible and None is returned."""
+    if odtfile:
+        source = odtfile.open(path)
+        f = source
+        if hash_algorithm:
+            f = HashingReader(source, hash_algorithm)
+        g = open(destination_path, "wb")
+        shutil.copyfileobj(f, g, HASH_CHUNK_SIZE)
+        g.close()
+        source.close()
+
+        if hash_algorithm:
+            return f.digest()
+        return None
+
+    source_path = os.path.join(temp_folder, path)
+    try:
+        if os.path.exists(destination_path):
+            os.remove(destination_path)
+        os.link(source_path, destination_path)
+    except (AttributeError, OSError):
+        # No hard link on this platform or across file systems.
+        shutil.copyfile(source_path, destination_path)
+
+    return None
+
+
+def getOdtPictureOpeners(paths, temp_folder, odtfile):
+    "Return a dictionary translating the odt picture paths into functions opening them."
+    openers = {}
+    for path in paths:
+        if odtfile:
+            openers[path] = functools.partial(odtfile.open, path)
+        else:
+            openers[path] = functools.partial(open, os.path.join(temp_folder, path), "rb")
+
+    return openers
+
+
+def synchronizeImagesFoldersByHash(temp_folder, output_path, images_relative_folder, odt_pictures_sizes, odtfile = None, hash_algorithm = "md5", hash_jobs = 1):
+    """Same as synchronizeImagesFolders but the pictures are named after the hash of their content so that the images folder is never listed.
+    A picture is only read to be hashed when the images folder already has it. A missing picture of the archive is streamed into
+    a temp file of the images folder through a HashingReader, the temp file being then renamed after the hash of the copied content.
+    A missing unpacked picture is linked or copied."""
+    output_folder, output_name = os.path.split(output_path)
+    image_folder = os.path.join(output_folder, images_relative_folder)
+
+    if odt_pictures_sizes and not os.path.isdir(image_folder):
+        os.mkdir(image_folder)
+
+    openers = getOdtPictureOpeners(odt_pictures_sizes, temp_folder, odtfile)
+
+    def getPictureRelativePath(path, h):
+        name, ext = os.path.splitext(path)
+        return os.path.join(images_relative_folder, "picture_" + h.encode("hex")) + ext
+
+    def synchronizePicture(path):
+        picture_relative_path = getPictureRelativePath(path, hashFile(openers[path](), hash_algorithm))
+
+        # The same name means the same content: the picture is already there.
+        if os.path.exists(os.path.join(output_folder, picture_relative_path)):
+            return path, picture_relative_path
+
+        # A picture interrupted while copied must not be taken for a complete one: it is copied into a temp file first.
+        name, ext = os.path.splitext(path)
+        fd, temp_path = tempfile.mkstemp(ext + ".tmp", "picture_", image_folder)
+        os.close(fd)
+        try:
+            copy_hash = copyOdtPicture(path, temp_folder, odtfile, temp_path, odtfile and hash_algorithm)
+            if copy_hash is not None:
+                picture_relative_path = getPictureRelativePath(path, copy_hash)
+
+            picture_path = os.path.join(output_folder, picture_relative_path)
+            if not os.path.exists(picture_path):
+                os.rename(temp_path, picture_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        return path, picture_relative_path
+
+    if hash_jobs <= 1 or len(odt_pictures_sizes) <= 1:
+        return dict(map(synchronizePicture, odt_pictures_sizes))
+
+    pool = multiprocessing.pool.ThreadPool(min(hash_jobs, len(odt_pictures_sizes)))
+    try:
+        return dict(pool.map(synchronizePicture, list(odt_pictures_sizes)))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def synchronizeImagesFolders(temp_folder, output_path, images_relative_folder, odt_pictures_sizes, odtfile = None, use_manifest = False, hash_algorithm = "md5", hash_jobs = 1, image_naming = "sequential"):
+    """Copy the new pictures into the images folder and return a dictionary translating odt image path into rst image path. The pictures are taken from the odt archive when odtfile is given and from the temp folder otherwise.
+    An archive opened from a file object shares it between its members so they can't be read by several threads: its callers must pass hash_jobs = 1."""
+    if image_naming == "hash":
+        return synchronizeImagesFoldersByHash(temp_folder, output_path, images_relative_folder, odt_pictures_sizes, odtfile, hash_algorithm, hash_jobs)
+
     output_folder, output_name = os.path.split(output_path)
     image_folder = os.path.join(output_folder, images_relative_folder)
 
-    hashes_rst_images = getHashesRstImages(output_folder, images_relative_folder)
+    manifest = None
+    if use_manifest:
+        manifest = getImagesManifest(image_folder, hash_algorithm)
+
+    # Only the pictures and images having the same size can be identical, the other ones are not hashed at all.
+    hashes_rst_images = getHashesRstImages(output_folder, images_relative_folder, manifest, set(odt_pictures_sizes.values()), hash_algorithm, hash_jobs)
+
+    rst_images_sizes = set()
+    for path in hashes_rst_images.values():
+        rst_images_sizes.add(os.path.getsize(os.path.join(output_folder, path)))
+
+    paths = []
+    for path in odt_pictures_sizes:
+        if odt_pictures_sizes[path] in rst_images_sizes:
+            paths.append(path)
+    openers = getOdtPictureOpeners(paths, temp_folder, odtfile)
+
+    odt_pictures_hashes = hashFiles(openers, hash_algorithm, hash_jobs)
 
     # Build the picture_dict that convert odt image path into rst image path (when possible)
     picture_prefix = "picture_"
-    existing_picture_names = []
+    existing_picture_names = set()
     if os.path.isdir(image_folder):
         for path in os.listdir(image_folder):
             path = path.lower()
@@ -155,13 +692,13 @@ def synchronizeImagesFolders(temp_folder, output_path, images_relative_folder, o
             if not name.startswith(picture_prefix):
                 continue
 
-            existing_picture_names.append(name)
+            existing_picture_names.add(name)
 
     picture_dict = {}
     picture_index = 0
-    for path in odt_pictures_hashes:
-        h = odt_pictures_hashes[path]
-        if h in hashes_rst_images:
+    for path in odt_pictures_sizes:
+        h = odt_pictures_hashes.get(path, None)
+        if h is not None and h in hashes_rst_images:
             picture_dict[path] = hashes_rst_images[h]
         else:
             # Find an available picture name:
@@ -169,7 +706,7 @@ def synchronizeImagesFolders(temp_folder, output_path, images_relative_folder, o
                 picture_index += 1
 
             picture_name = picture_prefix + str(picture_index)
-            existing_picture_names.append(picture_name)
+            existing_picture_names.add(picture_name)
 
             name, ext = os.path.splitext(path)
             picture_relative_path = os.path.join(images_relative_folder, picture_name) + ext
@@ -177,13 +714,37 @@ def synchronizeImagesFolders(temp_folder, output_path, images_relative_folder, o
             if not os.path.isdir(image_folder):
                 os.mkdir(image_folder)
 
-            shutil.copyfile(os.path.join(temp_folder, path), os.path.join(output_folder, picture_relative_path))
+            # The hash of a picture copied from the archive comes for free, it is kept for the manifest.
+            copy_hash_algorithm = None
+            if manifest and h is None:
+                copy_hash_algorithm = hash_algorithm
+
+            copy_hash = copyOdtPicture(path, temp_folder, odtfile, os.path.join(output_folder, picture_relative_path), copy_hash_algorithm)
+            if copy_hash is not None:
+                h = copy_hash
+
+            if manifest:
+                manifest.setHash(picture_name + ext, h)
 
             picture_dict[path] = picture_relative_path
 
+    if manifest and os.path.isdir(image_folder):
+        manifest.save()
+
     return picture_dict
 
 
+def synchronizeImagesFoldersLocked(*args, **kwargs):
+    "Same as synchronizeImagesFolders but serialized with the other batch workers."
+    if IMAGES_LOCK:
+        IMAGES_LOCK.acquire()
+    try:
+        return synchronizeImagesFolders(*args, **kwargs)
+    finally:
+        if IMAGES_LOCK:
+            IMAGES_LOCK.release()
+
+
 class Style:
     def __init__(self):
         self.name = ""
@@ -191,6 +752,8 @@ class Style:
         self.family = ""
 
         self.margin_left = 0
+        # Set to False when the margin should be inherited from the parent style.
+        self.has_margin_left = False
 
         self.font_style = ""
         self.font_weight = ""
@@ -202,6 +765,7 @@ class Style:
 
         for child in node:
             if child.tag == style_prefix + "paragraph-properties":
+                self.has_margin_left = fo_prefix + "margin-left" in child.attrib
                 self.margin_left = child.attrib.get(fo_prefix + "margin-left", "0in")
                 if self.margin_left.endswith("in"):
                     self.margin_left = float(self.margin_left[:-2])
@@ -243,6 +807,85 @@ class Style:
         return ret
 
 
+class ResolvedStyle:
+    "The effective properties of a style once its parent styles are taken into account."
+    def __init__(self):
+        self.family = ""
+
+        self.margin_left = 0
+
+        self.font_style = ""
+        self.font_weight = ""
+
+        self.bold = False
+        self.italic = False
+
+        # The rst inline markup of the spans of this style.
+        self.markup = ""
+
+
+class StyleResolver:
+    "Resolve the styles following their parent styles. Each style name is resolved once and cached."
+    def __init__(self, styles):
+        self.styles = styles
+        self.cache = {}
+
+    def clear(self):
+        "Forget the resolved styles (to be called when the styles change)."
+        self.cache = {}
+
+    def resolve(self, name):
+        resolved = self.cache.get(name, None)
+        if resolved is None:
+            resolved = self.resolveStyle(name)
+            self.cache[name] = resolved
+
+        return resolved
+
+    def resolveStyle(self, name):
+        resolved = ResolvedStyle()
+
+        # Walk the parent chain from the style itself, the nearest style setting a property wins.
+        has_margin_left = False
+        visited = set()
+        style = self.styles.get(name, None)
+        if style:
+            resolved.family = style.family
+
+        while style and style.name not in visited:
+            visited.add(style.name)
+
+            if not has_margin_left and style.has_margin_left:
+                resolved.margin_left = style.margin_left
+                has_margin_left = True
+
+            if not resolved.font_style:
+                resolved.font_style = style.font_style
+
+            if not resolved.font_weight:
+                resolved.font_weight = style.font_weight
+
+            style = self.styles.get(style.parent_name, None)
+
+        resolved.bold = resolved.family == "text" and resolved.font_weight == "bold"
+        resolved.italic = resolved.family == "text" and resolved.font_style == "italic"
+
+        if name == "rststyle-strong":
+            resolved.markup = "**"
+        elif name == "rststyle-emphasis":
+            resolved.markup = "*"
+        elif resolved.bold:
+            # TODO: we should check the attributes of the rststyle-strong and rststyle-emphasis styles.
+            resolved.markup = "**"
+        elif resolved.italic:
+            # TODO: we should check the attributes of the rststyle-strong and rststyle-emphasis styles.
+            resolved.markup = "*"
+        elif name in ["rststyle-inlineliteral"]:
+            resolved.markup = "``"
+
+        return resolved
+
+
 def extractStylesFromNode(node):
     ret = {}
     for child in node:
@@ -344,6 +987,45 @@ class ListLevelInfo:
         self.identation = 0
 
 
+def getXmlBackendName(name = "auto"):
+    "Return the name of the xml backend to use for name, the first available one for auto."
+    if name == "auto":
+        for name in XML_BACKEND_PREFERENCES:
+            if name in XML_BACKENDS:
+                return name
+
+    if name not in XML_BACKENDS:
+        raise ValueError('The xml backend "%s" is not available' % name)
+
+    return name
+
+
+def parseXml(source, backend = "auto"):
+    "Parse the xml file (path or file object) and return its root element."
+    name = getXmlBackendName(backend)
+    module = XML_BACKENDS[name]
+
+    if name == "lxml":
+        # Drop the comments as ElementTree does and allow the text nodes of the big documents.
+        parser = module.XMLParser(huge_tree = True, remove_comments = True)
+    elif name == "elementtree":
+        parser = module.XMLTreeBuilder()
+    else:
+        parser = module.XMLParser()
+
+    doc = module.parse(source, parser)
+    return doc.getroot()
+
+
+def iterparseXml(source, events, backend = "auto"):
+    "Same as ElementTree.iterparse() with the xml backend."
+    name = getXmlBackendName(backend)
+    if name == "lxml":
+        return XML_BACKENDS[name].iterparse(source, events, huge_tree = True, remove_comments = True)
+
+    return XML_BACKENDS[name].iterparse(source, events)
+
+
 def splitIntoLines(text, wrap_width):
     if wrap_width <= 0:
         text = re.sub(r"([a-zA-Z]{2})\. +", r"\1.\n", text)
@@ -353,42 +1035,60 @@ def splitIntoLines(text, wrap_width):
     return text
 
 
-def getRawText(node):
-    text = ""
+def walkText(node, container_tags, getChildText = None):
+    """Return the text of node including the text of its descendants of the container tags. The other children are replaced by getChildText(child) (nothing when None).
+    The descendants are walked with an explicit stack so that deeply nested elements do not hit the recursion limit."""
+    text = []
     if node.text:
-        text += node.text
-    for child in node:
-        if child.tag in [text_prefix + "p", text_prefix + "span"]:
-            text += getRawText(child)
+        text.append(node.text)
+
+    # The children iterators being walked with the tail to append once they are exhausted.
+    stack = [(iter(node), None)]
+    while stack:
+        children, tail = stack[-1]
+        for child in children:
+            if child.tag in container_tags:
+                if child.text:
+                    text.append(child.text)
+                stack.append((iter(child), child.tail))
+                break
+
+            if getChildText is not None:
+                text.append(getChildText(child))
+
+            if child.tail:
+                text.append(child.tail)
+
+        else:
+            stack.pop()
+            if tail:
+                text.append(tail)
+
+    return "".join(text)
+
 
-        if child.tail:
-            text += child.tail
+TEXT_CONTAINER_TAGS = set([text_prefix + "p", text_prefix + "span"])
 
+
+def getRawText(node):
+    text = walkText(node, TEXT_CONTAINER_TAGS)
     text = text.replace("\n", " ")
     return text
 
 
-def getCodeText(node):
-    text = ""
-    if node.text:
-        text += node.text
-    for child in node:
-        if child.tag in [text_prefix + "p", text_prefix + "span"]:
-            text += getCodeText(child)
-
-        if child.tag == text_prefix + "line-break":
-            text += "\n"
+def getCodeChildText(child):
+    if child.tag == text_prefix + "line-break":
+        return "\n"
 
-        if child.tag == text_prefix + "s":
-            identation = int(child.attrib[text_prefix + "c"])
-            identation = " " * identation
+    if child.tag == text_prefix + "s":
+        identation = int(child.attrib[text_prefix + "c"])
+        return " " * identation
 
-            text += identation
+    return ""
 
-        if child.tail:
-            text += child.tail
 
-    return text
+def getCodeText(node):
+    return walkText(node, TEXT_CONTAINER_TAGS, getCodeChildText)
 
 
 def escapeCellText(text):
@@ -399,133 +1099,461 @@ def escapeCellText(text):
     return text
 
 
+class TableLayout:
+    """Place the cells of a table on its grid and compute the column widths while the cells are added, in a single pass.
+    The grid is only known through, for each column, the row under the last cell covering it."""
+    def __init__(self):
+        self.column_widths = []
+        self.covered_until = array.array("i")
+
+        self.row_index = -1
+        self.column_index = 0
+
+    def addRow(self):
+        self.row_index += 1
+        self.column_index = 0
+
+    def addCell(self, length, h_span = 1, v_span = 1):
+        "Place the next cell of the current row, whose text has length characters, and return its column index."
+        covered_until = self.covered_until
+        column_widths = self.column_widths
+
+        # Skip the columns covered by the cells of the previous rows:
+        column_index = self.column_index
+        while column_index < len(covered_until) and covered_until[column_index] > self.row_index:
+            column_index += 1
+
+        while len(covered_until) < column_index + h_span:
+            covered_until.append(0)
+            column_widths.append(0)
+
+        for index in range(column_index, column_index + h_span):
+            covered_until[index] = self.row_index + v_span
+
+        actual_width = sum(column_widths[column_index : column_index + h_span]) + h_span - 1
+        width = length + 2
+        if width > actual_width:
+            addition = int(math.ceil((width - actual_width) / float(h_span)))
+            for index in range(column_index, column_index + h_span):
+                column_widths[index] += addition
+
+        self.column_index = column_index + h_span
+
+        return column_index
+
+
 class Table:
+    "A table stored as flat arrays: the cells texts, columns and spans in row order and, for each row, the index of its first cell and its header flag."
     def __init__(self):
-        self.rows = []
+        self.layout = TableLayout()
+
+        self.texts = []
+        self.columns = array.array("i")
+        self.h_spans = array.array("i")
+        self.v_spans = array.array("i")
+
+        self.row_starts = array.array("i")
+        self.headers = array.array("b")
 
     def __str__(self):
         ret = "Table(\n"
         ret += "  rows : [\n"
-        for row in self.rows:
-            ret += str(row) + ",\n"
+        for header, cells in self.iterRows():
+            ret += "    %s %r,\n" % (header and "header" or "row", cells)
         ret += "  ]\n"
         ret += ")\n"
 
         return ret
 
-    def addCoveredCells(self):
-        num_columns = 0
-        row  = self.rows[0]
-        for cell in row.cells:
-            num_columns += cell.h_span
+    def addRow(self, header = False):
+        self.layout.addRow()
+        self.row_starts.append(len(self.texts))
+        self.headers.append(header)
 
-        grid = [[None for i in range(num_columns)] for j in range(len(self.rows))]
+    def addCell(self, text, h_span = 1, v_span = 1):
+        self.columns.append(self.layout.addCell(len(text), h_span, v_span))
+        self.texts.append(text)
+        self.h_spans.append(h_span)
+        self.v_spans.append(v_span)
 
-        for row_index in range(len(self.rows)):
-            row = self.rows[row_index]
+    def getColumnWidths(self):
+        return self.layout.column_widths
+
+    def iterRows(self):
+        "Yield the header flag and the list of (text, column index, h_span, v_span) cells of each row."
+        row_ends = self.row_starts[1:] + array.array("i", [len(self.texts)])
+        for row_index in range(len(self.row_starts)):
+            cells = []
+            for cell_index in range(self.row_starts[row_index], row_ends[row_index]):
+                cells.append((self.texts[cell_index], self.columns[cell_index], self.h_spans[cell_index], self.v_spans[cell_index]))
+
+            yield bool(self.headers[row_index]), cells
+
+
+class GridTableRenderer:
+    "Render the rows of a grid table one after the other."
+    def __init__(self, column_widths):
+        self.column_widths = column_widths
+
+        num_columns = len(column_widths)
+        # For each column, the row under the last cell covering it and whether the column is the first one of that cell.
+        self.covered_until = array.array("i", [0]) * num_columns
+        self.left_walls = array.array("b", [1]) * num_columns
+
+        self.row_index = 0
+        self.previous_header = False
+        # The closing border of the table.
+        self.bottom = ""
+
+    def renderRow(self, header, cells):
+        "Return the top border and the body line of a row, cells being its (text, column index, h_span, v_span) list."
+        column_widths = self.column_widths
+        covered_until = self.covered_until
+        left_walls = self.left_walls
+
+        top_char = "-"
+        if self.previous_header:
+            top_char = "="
+
+        top = []
+        body = []
+        cell_index = 0
+        column_index = 0
+        while column_index < len(column_widths):
+            if cell_index < len(cells) and cells[cell_index][1] == column_index:
+                text, column_index, h_span, v_span = cells[cell_index]
+                cell_index += 1
+
+                for index in range(column_index, column_index + h_span):
+                    top.append("+")
+                    top.append(top_char * column_widths[index])
+
+                    covered_until[index] = self.row_index + v_span
+                    left_walls[index] = index == column_index
+
+                width = sum(column_widths[column_index : column_index + h_span]) + h_span - 1
+                body.append("| ")
+                body.append(text)
+                body.append(" " * (width - len(text) - 2))
+                body.append(" ")
+
+                column_index += h_span
+
+            elif covered_until[column_index] > self.row_index:
+                # Covered by a cell of a previous row:
+                if left_walls[column_index]:
+                    top.append("+")
+                    body.append("|")
+                else:
+                    top.append(" ")
+                    body.append(" ")
+                top.append(" " * column_widths[column_index])
+                body.append(" " * column_widths[column_index])
 
-            column_index = 0
-            for cell in row.cells:
-                while column_index < num_columns and grid[row_index][column_index]:
-                    column_index += 1
+                column_index += 1
 
-                grid[row_index][column_index] = cell
-                for extra_column_index in range(cell.h_span):
-                    for extra_row_index in range(cell.v_span):
-                        if extra_column_index == 0 and extra_row_index == 0:
-                            continue
-                        covered_cell = TableCell()
-                        grid[row_index + extra_row_index][column_index + extra_column_index] = covered_cell
-                        covered_cell.covered = True
+            else:
+                # No cell (the row is shorter than the table):
+                top.append("+")
+                top.append(top_char * column_widths[column_index])
+                body.append("|")
+                body.append(" " * column_widths[column_index])
 
-                        if extra_column_index:
-                            covered_cell.left_wall = False
+                column_index += 1
+
+        top.append("+\n")
+        body.append("|\n")
+
+        top = "".join(top)
+        if self.row_index == 0:
+            self.bottom = top
+
+        self.row_index += 1
+        self.previous_header = header
+
+        return top + "".join(body)
+
+
+class Profile:
+    """Record the wall time, the cpu time and the bytes processed by each stage of a conversion (unpack, images, parse, styles, transform, write, clean).
+    The stages can be nested: the time spent in a nested stage (the writes during the transform for instance) is not counted in the enclosing one."""
+    def __init__(self, input_path = "", output_path = "", element_stats = False):
+        self.input_path = input_path
+        self.output_path = output_path
+
+        # The ElementStats of the document when element_stats is True.
+        self.elements = None
+        if element_stats:
+            self.elements = ElementStats()
+
+        # Translate a stage name into a [wall time, cpu time, bytes, calls] list.
+        self.stages = {}
+        # The [name, wall time, cpu time] of the stages begun and not ended yet.
+        self.running = []
+
+        self.start_times = self.getTimes()
+
+    def getTimes(self):
+        times = os.times()
+        return time.time(), times[0] + times[1]
+
+    def getStage(self, name):
+        if name not in self.stages:
+            self.stages[name] = [0.0, 0.0, 0, 0]
+        return self.stages[name]
+
+    def charge(self, entry, wall_time, cpu_time):
+        "Add the time elapsed since the running stage entry started, or resumed, to its stage."
+        stage = self.getStage(entry[0])
+        stage[0] += wall_time - entry[1]
+        stage[1] += cpu_time - entry[2]
+        entry[1] = wall_time
+        entry[2] = cpu_time
+
+    def begin(self, name):
+        wall_time, cpu_time = self.getTimes()
+        if self.running:
+            self.charge(self.running[-1], wall_time, cpu_time)
+        self.running.append([name, wall_time, cpu_time])
+
+    def end(self, name, size = 0):
+        wall_time, cpu_time = self.getTimes()
+        entry = self.running.pop()
+        assert entry[0] == name, "stage %s ended while %s is running" % (name, entry[0])
+        self.charge(entry, wall_time, cpu_time)
+
+        stage = self.getStage(name)
+        stage[2] += size
+        stage[3] += 1
+
+        if self.running:
+            self.running[-1][1] = wall_time
+            self.running[-1][2] = cpu_time
+
+    def getRecord(self):
+        "Return the profile as a dictionary ready to be dumped in json."
+        wall_time, cpu_time = self.getTimes()
+
+        stages = {}
+        for name in self.stages:
+            stage = self.stages[name]
+            stages[name] = {"wall": stage[0], "cpu": stage[1], "bytes": stage[2], "calls": stage[3]}
+
+        record = {
+            "input": os.path.abspath(self.input_path) if self.input_path else "",
+            "output": os.path.abspath(self.output_path) if self.output_path else "",
+            "wall": wall_time - self.start_times[0],
+            "cpu": cpu_time - self.start_times[1],
+            "stages": stages}
+
+        if self.elements is not None:
+            record["elements"] = self.elements.getRecord()
+
+        return record
+
+
+def getShortTag(tag):
+    for prefix, short_prefix in short_prefixes:
+        if tag.startswith(prefix):
+            return short_prefix + tag[len(prefix):]
+    return tag
 
-                        if extra_row_index:
-                            covered_cell.top_wall = False
 
-        for row_index in range(len(self.rows)):
-            row = self.rows[row_index]
+class ElementStats:
+    "Count the elements going through the handlers by tag and style name and accumulate the time spent in the handlers, nested handlers excluded."
+    def __init__(self):
+        # Translate a "tag/style name" key into a [calls, time] list.
+        self.entries = {}
+        # The [key, start time] of the handlers running.
+        self.running = []
+
+    def getKey(self, element):
+        style_name = element.get(text_prefix + "style-name")
+        if style_name:
+            return "%s/%s" % (getShortTag(element.tag), style_name)
+        return getShortTag(element.tag)
+
+    def begin(self, element):
+        now = time.time()
+        if self.running:
+            self.charge(self.running[-1], now)
+        self.running.append([self.getKey(element), now])
+
+    def end(self):
+        now = time.time()
+        entry = self.running.pop()
+        self.charge(entry, now)
+        self.entries[entry[0]][0] += 1
+
+        if self.running:
+            self.running[-1][1] = now
+
+    def charge(self, entry, now):
+        if entry[0] not in self.entries:
+            self.entries[entry[0]] = [0, 0.0]
+        self.entries[entry[0]][1] += now - entry[1]
+        entry[1] = now
+
+    def merge(self, record):
+        "Add the counters of an other document (as returned by getRecord)."
+        for key in record:
+            if key not in self.entries:
+                self.entries[key] = [0, 0.0]
+            self.entries[key][0] += record[key]["calls"]
+            self.entries[key][1] += record[key]["time"]
+
+    def getRecord(self):
+        ret = {}
+        for key in self.entries:
+            calls, elapsed = self.entries[key]
+            ret[key] = {"calls": calls, "time": elapsed}
+        return ret
 
-            row.cells = grid[row_index]
+    def getReport(self):
+        "Return the counters as a text table sorted by decreasing time."
+        total = sum([entry[1] for entry in self.entries.values()])
+        lines = ["%-50s %10s %10s %7s %10s" % ("element", "calls", "time ms", "time %", "avg us")]
+        for key, (calls, elapsed) in sorted(self.entries.items(), key = lambda item: (-item[1][1], item[0])):
+            lines.append("%-50s %10d %10.2f %7.1f %10.2f" % (key, calls, elapsed * 1000, elapsed * 100 / max(total, 1e-9), elapsed * 1e6 / max(calls, 1)))
+        lines.append("%-50s %10d %10.2f" % ("total", sum([entry[0] for entry in self.entries.values()]), total * 1000))
+        return "\n".join(lines)
 
-    def getColumnWidths(self):
-        column_widths = []
 
-        for row in self.rows:
-            column_index = 0
-            while column_index < len(row.cells):
-                cell = row.cells[column_index]
+def saveProfiles(path, records):
+    "Write the profile records of the converted documents into the json file at path."
+    tmp_path = path + ".tmp"
+    f = open(tmp_path, "wb")
+    try:
+        json.dump({"version": VERSION, "documents": records}, f, indent = 1, sort_keys = True)
+    finally:
+        f.close()
 
-                if cell.covered:
-                    column_index += 1
-                    continue
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
 
-                while len(column_widths) < column_index + cell.h_span:
-                    column_widths.append(0)
 
-                actual_width = sum(column_widths[column_index : column_index + cell.h_span]) + cell.h_span - 1
-                width = len(cell.text) + 2
-                if width > actual_width:
-                    addition = int(math.ceil((width - actual_width) / float(cell.h_span)))
-                    for index in range(column_index, column_index + cell.h_span):
-                        column_widths[index] += addition
+class CountingReader:
+    "Read a file (path or file object) counting the bytes read from it."
+    def __init__(self, source):
+        self.close_file = isinstance(source, basestring)
+        if self.close_file:
+            self.file = open(source, "rb")
+        else:
+            self.file = source
+        self.count = 0
 
-                column_index += cell.h_span
+    def read(self, size = -1):
+        data = self.file.read(size)
+        self.count += len(data)
+        return data
 
-        return column_widths
+    def close(self):
+        if self.close_file:
+            self.file.close()
 
 
-class TableRow:
-    def __init__(self):
-        self.header = False
-        self.cells = []
+class OutputBuffer:
+    "Collect the text fragments and write them utf8 encoded into the file by chunks of at least size characters."
+    def __init__(self, file, size = 64 * 1024, profile = None):
+        self.file = file
+        self.size = size
+        self.profile = profile
 
-    def __str__(self):
-        ret = "Row(\n"
-        ret += "  rows : [\n"
-        for cell in self.cells:
-            ret += str(cell) + ",\n"
-        ret += "  ]\n"
-        ret += ")\n"
+        self.fragments = []
+        self.length = 0
 
-        return ret
+    def write(self, text):
+        self.fragments.append(text)
+        self.length += len(text)
 
+        if self.length >= self.size:
+            self.flush()
 
-class TableCell:
-    def __init__(self):
-        self.h_span = 1
-        self.v_span = 1
+    def flush(self):
+        if not self.fragments:
+            return
 
-        self.text = ""
+        if self.profile:
+            self.profile.begin("write")
 
-        self.covered = False
-        self.top_wall = True
-        self.left_wall = True
+        text = "".join(self.fragments).encode("utf8")
+        self.file.write(text)
 
-    def __str__(self):
-        ret = "Cell(\n"
-        ret += "  h_span : %d,\n" % self.h_span
-        ret += "  v_span : %d,\n" % self.v_span
-        ret += '  text : "%s",\n' % self.text
-        ret += '  covered : %d,\n' % self.covered
-        ret += ")\n"
+        if self.profile:
+            self.profile.end("write", len(text))
 
-        return ret
+        self.fragments = []
+        self.length = 0
 
 
-class RstDocument:
-    # Set here the char that should be used to underline the titles according to they levels.
-    # The default is the Python convention for documentation.
-    level_formats = LEVEL_FORMATS
-    identation_string = "   "
+MODEL_VERSION = 1
 
-    def __init__(self, path = ""):
-        self.path = path
-        self.file = None
+# The reference to the index-th inline image of a document model in its texts.
+model_image_regex = re.compile("\x00(\\d+)\x00")
 
-        self.styles = {}
+
+class DocumentModel:
+    """The rst document as the list of the RstDocument calls writing it, recorded while converting content.xml.
+    The calls arguments do not depend on the options of the rst output (wrap width, images folder, tables format, pictures names...) so that one model is rendered into several rst variants."""
+    def __init__(self):
+        # The (method name, arguments tuple) of the write calls.
+        self.calls = []
+        # The odt paths of the inline images, referred to as \x00index\x00 in the texts.
+        self.inline_images = []
+        # The odt paths of the pictures content.xml refers to.
+        self.picture_hrefs = set()
+
+
+class NodeTableSource:
+    "The rows of a table element. The cells texts are computed again each time the rows are iterated."
+    def __init__(self, document, table_node):
+        self.document = document
+        self.table_node = table_node
+
+    def iterSpans(self):
+        "Yield the header flag and the (h_span, v_span) of the cells of each row."
+        for header, row_node in self.document.iterTableRows(self.table_node):
+            yield header, [(h_span, v_span) for cell_node, h_span, v_span in self.document.iterTableCells(row_node)]
+
+    def iterRows(self):
+        "Yield the header flag and the (text, h_span, v_span) of the cells of each row."
+        for header, row_node in self.document.iterTableRows(self.table_node):
+            yield header, [(self.document.getElementText(cell_node), h_span, v_span) for cell_node, h_span, v_span in self.document.iterTableCells(row_node)]
+
+
+class ModelTableSource:
+    "The rows of a table of a document model, the inline images of the cells texts resolved by the document."
+    def __init__(self, document, rows):
+        self.document = document
+        self.rows = rows
+
+    def iterSpans(self):
+        for header, cells in self.rows:
+            yield header, [(h_span, v_span) for text, h_span, v_span in cells]
+
+    def iterRows(self):
+        for header, cells in self.rows:
+            yield header, [(self.document.resolveText(text), h_span, v_span) for text, h_span, v_span in cells]
+
+
+class RstDocument:
+    # Set here the char that should be used to underline the titles according to they levels.
+    # The default is the Python convention for documentation.
+    level_formats = LEVEL_FORMATS
+    identation_string = "   "
+
+    def __init__(self, path = "", file = None, profile = None):
+        "The rst document is written into the file object when given (it is then left open) and into the file at path otherwise. The stages are recorded in the profile when given."
+        self.path = path
+        self.file = file
+        self.close_file = file is None
+        self.output = None
+        self.profile = profile
+
+        self.styles = {}
         self.list_styles = {}
+        self.style_resolver = StyleResolver(self.styles)
 
         self.lists = []
         # Keep the list levels info to merge consecutive lists:
@@ -537,6 +1565,12 @@ class RstDocument:
         self.inline_images = {}
         self.paragraphs = []
 
+        # The stack of the transformNode() being run.
+        self.walk_stack = None
+
+        # The DocumentModel being rendered.
+        self.model = None
+
     def getLastListLevel(self):
         return self.lists[-1].levels[-1]
 
@@ -552,15 +1586,17 @@ class RstDocument:
             if DEBUG_FLAG:
                 text += "endof para"
             text += "\n"
-            text = text.encode("utf8")
-            self.file.write(text)
+            self.output.write(text)
 
         self.paragraphs = []
 
     def open(self, path = ""):
-        if path:
-            self.path = path
-        self.file = open(self.path, "w")
+        if self.close_file:
+            if path:
+                self.path = path
+            self.file = open(self.path, "w")
+
+        self.output = OutputBuffer(self.file, self.options.buffer_size, self.profile)
 
     def close(self):
         self.flush()
@@ -568,18 +1604,19 @@ class RstDocument:
         for path in self.inline_images:
             name = self.inline_images[path]
             text = "\n.. |%s| image:: %s\n" % (name, path)
-            text = text.encode("utf8")
-            self.file.write(text)
+            self.output.write(text)
+
+        self.output.flush()
 
-        self.file.close()
+        if self.close_file:
+            self.file.close()
 
     def write(self, text):
         self.flush()
 
-        text = text.encode("utf8")
 #       if text == "\n":
 #           raise Exception("hidden return")
-        self.file.write(text)
+        self.output.write(text)
 
     def writeTitle(self, text, level):
         paragraph = ""
@@ -603,22 +1640,11 @@ class RstDocument:
 #        if text.startswith("Unknown directive type"):
 #            return
 
-        paragraph = ""
-        if DEBUG_FLAG:
-            paragraph += "pre-para"
-        paragraph += "\n"
-
-#       if not self.lists:
-#           if DEBUG_FLAG:
-#               paragraph += "pre-para"
-#           paragraph += "\n"
-
-#       elif self.getLastListLevel().is_bullet_inserted:
-#           # A new paragraph in a list item needs a blank line to mark the separation with the previous one.
-#           if DEBUG_FLAG:
-#               paragraph += "pre-item"
-#           paragraph += "\n"
+        identation, bullet, non_bullet = self.getListPrefixes()
+        self.writeListParagraph(text, identation, bullet, non_bullet)
 
+    def getListPrefixes(self):
+        "Return the identation, the prefix of the first line and the prefix of the other lines of a new paragraph of the current list item and mark its bullet as inserted."
         identation = ""
         bullet = ""
         non_bullet = ""
@@ -660,6 +1686,25 @@ class RstDocument:
                 else:
                     identation += "  "
 
+        return identation, bullet, non_bullet
+
+    def writeListParagraph(self, text, identation, bullet, non_bullet):
+        paragraph = ""
+        if DEBUG_FLAG:
+            paragraph += "pre-para"
+        paragraph += "\n"
+
+#       if not self.lists:
+#           if DEBUG_FLAG:
+#               paragraph += "pre-para"
+#           paragraph += "\n"
+
+#       elif self.getLastListLevel().is_bullet_inserted:
+#           # A new paragraph in a list item needs a blank line to mark the separation with the previous one.
+#           if DEBUG_FLAG:
+#               paragraph += "pre-item"
+#           paragraph += "\n"
+
         text = splitIntoLines(text, self.options.wrap_width)
         text = text.split("\n")
 
@@ -733,342 +1778,514 @@ class RstDocument:
     def writeTable(self, table):
         self.write("\n")
 
-        table.addCoveredCells()
-        column_widths = table.getColumnWidths()
+        renderer = GridTableRenderer(table.getColumnWidths())
+        for header, cells in table.iterRows():
+            self.write(renderer.renderRow(header, cells))
 
-        bottom = ""
-        previous_header = False
-        for row_index in range(len(table.rows)):
-            row = table.rows[row_index]
+        self.write(renderer.bottom)
 
-            top = ""
-            body = ""
-            column_index = 0
-            while column_index < len(row.cells):
-                cell = row.cells[column_index]
-
-                if cell.covered:
-                    while column_index < len(row.cells):
-                        cursor_cell = row.cells[column_index]
-                        if not cursor_cell.covered:
-                            break
+    def getElementText(self, node):
+        text = walkText(node, self.inline_container_tags, self.getInlineText)
+        text = text.replace("\n", " ")
+        return text
 
-                        top_char = " "
-                        if cursor_cell.top_wall:
-                            if previous_header:
-                                top_char = "="
-                            else:
-                                top_char = "-"
+    def getInlineText(self, child):
+        handler = self.inline_handlers.get((child.tag, child.get(text_prefix + "style-name")), None)
+        if handler is None:
+            handler = self.inline_handlers.get(child.tag, None)
 
-                        cross_char = "+"
-                        if not cursor_cell.top_wall and not cursor_cell.left_wall:
-                            cross_char = " "
+        if handler is None:
+            print 'Unknown tag: "%s" in text.' % child.tag
+            return ""
 
-                        top +=  cross_char + top_char * column_widths[column_index]
+        return handler(self, child)
 
-                        wall_char = " "
-                        if cursor_cell.left_wall:
-                            wall_char = "|"
-                        body += wall_char + " " * column_widths[column_index]
+    def getInlineTextCounted(self, child):
+        "Same as getInlineText() counting and timing the handler."
+        self.profile.elements.begin(child)
+        text = RstDocument.getInlineText(self, child)
+        self.profile.elements.end()
+        return text
 
-                        column_index += 1
+    def getSpanText(self, span):
+        markup = self.style_resolver.resolve(span.attrib[text_prefix + "style-name"]).markup
+        if markup:
+            return "%s%s%s" % (markup, span.text, markup)
 
-                else:
-                    for cursor_column_index in range(column_index, column_index + cell.h_span):
-                        cursor_cell = row.cells[cursor_column_index]
-                        top_char = " "
-                        if cursor_cell.top_wall:
-                            if previous_header:
-                                top_char = "="
-                            else:
-                                top_char = "-"
+        if span.text is not None:
+            return span.text
 
-                        top +=  "+" + top_char * column_widths[cursor_column_index]
+        return ""
 
-                    width = sum(column_widths[column_index : column_index + cell.h_span]) + cell.h_span - 1
-                    body += "|" + " " + cell.text + " " * (width - len(cell.text) - 2) + " "
+    def getFrameText(self, frame):
+        if frame[0].tag != drawing_prefix + "image":
+            return ""
 
-                    column_index += cell.h_span
+        image = frame[0]
+        return self.getInlineImageText(image.attrib[xlink_prefix + "href"])
 
+    def getInlineImageText(self, path):
+        "Return the substitution reference of the inline image at the odt path, its definition is written at the end of the document."
+        if path in self.picture_dict:
+            path = self.picture_dict[path]
+        path = path.replace('\\', '/')
 
-            top += "+\n"
-            if row_index == 0:
-                bottom = top
+        folder, name = os.path.split(path)
+        name, ext = os.path.splitext(name)
 
-            body += "|\n"
+        self.inline_images[path] = name
 
-            self.write(top)
-            self.write(body)
+        return "|%s|" % name
 
-            previous_header = row.header
+    def resolveText(self, text):
+        "Replace the inline images references of a text of the document model by their substitution references."
+        if "\x00" not in text:
+            return text
 
-        self.write(bottom)
+        return model_image_regex.sub(lambda match: self.getInlineImageText(self.model.inline_images[int(match.group(1))]), text)
 
-    def getElementText(self, node):
-        text = ""
-        if node.text:
-            text += node.text
+    def iterTableRows(self, table_node):
+        "Yield the header flag and the node of each row of the table."
+        for child in table_node:
+            header = False
+            row_node = child
+            if child.tag == table_prefix + "table-header-rows":
+                header = True
+                row_node = child[0]
 
-        for child in node:
-            if child.tag == text_prefix + "span":
-                style_name = child.attrib[text_prefix + "style-name"]
-                style = self.styles.get(style_name, None)
-                if style_name == "rststyle-strong":
-                    text += "**%s**" % child.text
+            if row_node.tag != table_prefix + "table-row":
+                continue
 
-                elif style_name == "rststyle-emphasis":
-                    text += "*%s*" % child.text
+            yield header, row_node
 
-                elif style.isBold():
-                    # TODO: we should check the attributes of the rststyle-strong and rststyle-emphasis styles.
-                    text += "**%s**" % child.text
+    def iterTableCells(self, row_node):
+        "Yield the node, h_span and v_span of each cell of the row."
+        for cell_node in row_node:
+            if cell_node.tag != table_prefix + "table-cell":
+                continue
 
-                elif style.isItalic():
-                    # TODO: we should check the attributes of the rststyle-strong and rststyle-emphasis styles.
-                    text += "*%s*" % child.text
+            h_span = int(cell_node.attrib.get(table_prefix + "number-columns-spanned", 1))
+            v_span = int(cell_node.attrib.get(table_prefix + "number-rows-spanned", 1))
 
-                elif style_name in ["rststyle-inlineliteral"]:
-                    text += "``%s``" % child.text
+            yield cell_node, h_span, v_span
 
-                else:
-                    if child.text is not None:
-                        text += child.text
+    def iterTableTexts(self, source):
+        "Yield the header flag and the (text, h_span, v_span) of the cells of each row of the table source, the texts escaped for the tables cells."
+        for header, cells in source.iterRows():
+            yield header, [(escapeCellText(text), h_span, v_span) for text, h_span, v_span in cells]
 
-            elif child.tag == drawing_prefix + "frame":
-                if child[0].tag == drawing_prefix + "image":
-                    image = child[0]
-                    path = image.attrib[xlink_prefix + "href"]
-                    if path in self.picture_dict:
-                        path = self.picture_dict[path]
-                    path = path.replace('\\', '/')
+    def getTableFormat(self, source):
+        "Return the format of the table: grid, list or csv."
+        table_format = self.options.table_format
+        if table_format == "grid":
+            return "grid"
 
-                    folder, name = os.path.split(path)
-                    name, ext = os.path.splitext(name)
+        num_rows = 0
+        for header, spans in source.iterSpans():
+            num_rows += 1
+            for h_span, v_span in spans:
+                if v_span > 1:
+                    return "grid"
 
-                    text += "|%s|" % name
+        if table_format == "auto":
+            if num_rows >= self.options.compact_table_rows:
+                return "list"
+            return "grid"
 
-                    self.inline_images[path] = name
+        return table_format
 
-            elif child.tag == text_prefix + "p":
-                text += self.getElementText(child)
+    def transformTableNode(self, table_node):
+        self.writeTableSource(NodeTableSource(self, table_node))
 
-            else:
-                print 'Unknown tag: "%s" in text.' % child.tag
+    def writeTableRows(self, rows):
+        "Write a table of a document model given as a list of (header flag, [(text, h_span, v_span)...]) rows."
+        self.writeTableSource(ModelTableSource(self, rows))
 
-            if child.tail:
-                text += child.tail
+    def writeTableSource(self, source):
+        table_format = self.getTableFormat(source)
+        if table_format != "grid":
+            self.writeCompactTable(source, table_format)
+            return
 
-        text = text.replace("\n", " ")
-        return text
+        if self.options.stream_tables:
+            self.streamTable(source)
+            return
 
-    def transformTableNode(self, table_node):
         table = Table()
-        column_sizes = []
 
-        for child in table_node:
-            header = False
-            row_node = child
-            if child.tag == table_prefix + "table-header-rows":
-                header = True
-                row_node = child[0]
+        for header, cells in self.iterTableTexts(source):
+            table.addRow(header)
 
-            if row_node.tag != table_prefix + "table-row":
-                continue
+            for text, h_span, v_span in cells:
+                table.addCell(text, h_span, v_span)
 
-            row = TableRow()
-            row.header = header
-            table.rows.append(row)
+        self.writeTable(table)
 
-            for cell_node in row_node:
-                cell = TableCell()
-                if cell_node.tag != table_prefix + "table-cell":
-                    continue
-                row.cells.append(cell)
+    def streamTable(self, source):
+        "Write the table row by row. A first pass only computes the column widths from the cells texts lengths, the cells texts are computed again by the second pass writing each row."
+        # The texts are counted by the second pass only.
+        self.suspendElementStats()
+        try:
+            layout = TableLayout()
+            for header, cells in self.iterTableTexts(source):
+                layout.addRow()
+                for text, h_span, v_span in cells:
+                    layout.addCell(len(text), h_span, v_span)
+        finally:
+            self.resumeElementStats()
 
-                cell.h_span = int(cell_node.attrib.get(table_prefix + "number-columns-spanned", 1))
-                cell.v_span = int(cell_node.attrib.get(table_prefix + "number-rows-spanned", 1))
-                cell.text = self.getElementText(cell_node)
-                cell.text = escapeCellText(cell.text)
+        self.write("\n")
 
-        self.writeTable(table)
+        renderer = GridTableRenderer(layout.column_widths)
+        layout = TableLayout()
+        for header, texts in self.iterTableTexts(source):
+            layout.addRow()
+
+            cells = []
+            for text, h_span, v_span in texts:
+                cells.append((text, layout.addCell(len(text), h_span, v_span), h_span, v_span))
+
+            self.write(renderer.renderRow(header, cells))
+
+        self.write(renderer.bottom)
+
+    def writeCompactTable(self, source, table_format):
+        "Write a table without vertical spans as a list-table (table_format list) or csv-table (table_format csv) directive. The cells spanning several columns are followed by empty cells."
+        num_columns = 0
+        num_header_rows = 0
+        is_header = True
+        for header, spans in source.iterSpans():
+            is_header = is_header and header
+            if is_header:
+                num_header_rows += 1
+
+            row_columns = 0
+            for h_span, v_span in spans:
+                row_columns += h_span
+            num_columns = max(num_columns, row_columns)
+
+        self.write("\n.. %s-table::\n" % table_format)
+        if num_header_rows:
+            self.write("   :header-rows: %d\n" % num_header_rows)
+        self.write("\n")
+
+        for header, cells in self.iterTableTexts(source):
+            texts = []
+            for text, h_span, v_span in cells:
+                texts.append(text)
+                texts.extend([""] * (h_span - 1))
+            texts.extend([""] * (num_columns - len(texts)))
+
+            if table_format == "csv":
+                row = []
+                for text in texts:
+                    row.append('"%s"' % text.replace('"', '""'))
+                self.write("   " + ",".join(row) + "\n")
+
+            else:
+                row = []
+                for text in texts:
+                    if text:
+                        row.append("     - " + text + "\n")
+                    else:
+                        row.append("     -\n")
+                row[0] = "   *" + row[0][4:]
+                self.write("".join(row))
 
     def transformNode(self, node):
-        for child in node:
-            if child.tag == text_prefix + "p":
-                if not self.lists:
-                    self.last_levels = []
+        """Convert the children of node (an element or a list of elements).
+        The handlers schedule the conversion of the nested elements with walkChildren() which are then walked with an explicit stack, so deeply nested documents do not hit the recursion limit."""
+        outer_walk_stack = self.walk_stack
+
+        # The children iterators being walked with the function to call once they are exhausted.
+        stack = [(iter(node), None)]
+        self.walk_stack = stack
+        try:
+            while stack:
+                children, on_exit = stack[-1]
+                depth = len(stack)
+                for child in children:
+                    self.transformElement(child)
+                    if len(stack) != depth:
+                        break
 
-                style = child.attrib[text_prefix + "style-name"]
-                frame = child.find(drawing_prefix + "frame")
-                comment = child.find(office_prefix + "annotation")
+                else:
+                    stack.pop()
+                    if on_exit is not None:
+                        on_exit()
+        finally:
+            self.walk_stack = outer_walk_stack
+
+    def walkChildren(self, node, on_exit = None):
+        "Convert the children of node once the current handler returns and call on_exit() after the last one."
+        if self.walk_stack is None:
+            self.transformNode(node)
+            if on_exit is not None:
+                on_exit()
+            return
 
-                if style == "rststyle-title":
-                    self.writeTitle(child.text, 0)
+        self.walk_stack.append((iter(node), on_exit))
+
+    def transformElement(self, child):
+        if child.tag == text_prefix + "p" and not self.lists:
+            self.last_levels = []
+
+        handler = self.element_handlers.get((child.tag, child.get(text_prefix + "style-name")), None)
+        if handler is None:
+            handler = self.element_handlers.get(child.tag, None)
+
+        if handler is not None:
+            handler(self, child)
+
+    def transformElementCounted(self, child):
+        "Same as transformElement() counting and timing the handler."
+        self.profile.elements.begin(child)
+        RstDocument.transformElement(self, child)
+        self.profile.elements.end()
+
+    def installElementStats(self):
+        "Route the elements through the counted handlers when the profile counts them so that nothing is measured otherwise."
+        if self.profile and self.profile.elements is not None:
+            self.transformElement = self.transformElementCounted
+            self.getInlineText = self.getInlineTextCounted
+
+    def suspendElementStats(self):
+        "Stop counting the inline elements until resumeElementStats(), for the texts computed twice."
+        if self.profile and self.profile.elements is not None:
+            self.getInlineText = functools.partial(RstDocument.getInlineText, self)
+
+    def resumeElementStats(self):
+        if self.profile and self.profile.elements is not None:
+            self.getInlineText = self.getInlineTextCounted
+
+    def transformParagraph(self, child):
+        frame = None
+        comment = None
+        for grandchild in child:
+            if frame is None and grandchild.tag == drawing_prefix + "frame":
+                frame = grandchild
+            elif comment is None and grandchild.tag == office_prefix + "annotation":
+                comment = grandchild
+
+        if frame is not None and len(frame) and frame.attrib[text_prefix + "anchor-type"] == "paragraph":
+            if frame[0].tag == drawing_prefix + "image":
+                image = frame[0]
+                path = image.attrib[xlink_prefix + "href"]
+                self.writeImage(path)
+
+            elif frame[0].tag == drawing_prefix + "text-box":
+                try:
+                    text_box = frame[0]
+                    paragraph = text_box[0]
+                    frame = paragraph[0]
+                    image = frame[0]
+                    path = image.attrib[xlink_prefix + "href"]
+                    legend = frame.tail
 
-                elif style == "rststyle-admon-note-hdr":
-                    self.writeNoteHeader()
+                    self.writeFigure(path, legend)
+                except:
+                    print "fail to convert the figure"
 
-                elif style == "rststyle-admon-note-body":
-                    self.appendToNote(self.getElementText(child))
+        elif comment is not None and len(comment):
+            try:
+                text = getRawText(comment)
 
-                elif style == "rststyle-admon-warning-hdr":
-                    self.writeWarningHeader()
+                self.writeComment(text)
+            except:
+                print "fail to find the comment"
 
-                elif style == "rststyle-admon-warning-body":
-                    self.appendToWarning(self.getElementText(child))
+        else:
+            self.writeParagraph(self.getElementText(child))
 
-                elif style == "rststyle-blockindent":
-                    self.writeDefinitionBody(self.getElementText(child))
+    def transformTitleParagraph(self, child):
+        self.writeTitle(child.text, 0)
 
-                elif style == "rststyle-codeblock":
-                    self.writeCodeBlock(getCodeText(child))
+    def transformNoteHeader(self, child):
+        self.writeNoteHeader()
 
-                elif frame and frame.attrib[text_prefix + "anchor-type"] == "paragraph":
-                    if frame[0].tag == drawing_prefix + "image":
-                        image = frame[0]
-                        path = image.attrib[xlink_prefix + "href"]
-                        self.writeImage(path)
+    def transformNoteBody(self, child):
+        self.appendToNote(self.getElementText(child))
 
-                    elif frame[0].tag == drawing_prefix + "text-box":
-                        try:
-                            text_box = frame[0]
-                            paragraph = text_box[0]
-                            frame = paragraph[0]
-                            image = frame[0]
-                            path = image.attrib[xlink_prefix + "href"]
-                            legend = frame.tail
+    def transformWarningHeader(self, child):
+        self.writeWarningHeader()
 
-                            self.writeFigure(path, legend)
-                        except:
-                            print "fail to convert the figure"
+    def transformWarningBody(self, child):
+        self.appendToWarning(self.getElementText(child))
 
-                elif comment:
-                    try:
-                        text = getRawText(comment)
+    def transformBlockIndent(self, child):
+        self.writeDefinitionBody(self.getElementText(child))
 
-                        self.writeComment(text)
-                    except:
-                        print "fail to find the comment"
+    def transformCodeBlock(self, child):
+        self.writeCodeBlock(getCodeText(child))
 
-                else:
-                    self.writeParagraph(self.getElementText(child))
+    def transformHeading(self, child):
+        level = int(child.attrib[text_prefix + "outline-level"])
+        self.writeTitle(self.getElementText(child), level)
 
-            elif child.tag == text_prefix + "h":
-                level = int(child.attrib[text_prefix + "outline-level"])
-                self.writeTitle(self.getElementText(child), level)
+    def transformSection(self, child):
+        self.walkChildren(child)
 
-            elif child.tag == text_prefix + "section":
-                self.transformNode(child)
+    def transformOutlineList(self, child):
+        item = child[0]
+        while len(item):
+            if item[0].tag == text_prefix + "h":
+                self.walkChildren(item)
+                break;
+            item = item[0]
 
-            elif child.tag == text_prefix + "list":
-                style_name = child.attrib.get(text_prefix + "style-name", "")
-                if style_name == "Outline":
-                    item = child[0]
-                    while item._children:
-                        if item[0].tag == text_prefix + "h":
-                            self.transformNode(item)
-                            break;
-                        item = item[0]
+    def transformList(self, child):
+        style_name = child.attrib.get(text_prefix + "style-name", "")
 
-                else:
-                    list_info = ListInfo()
-                    list_info.style_name = style_name
-                    list_info.levels = list(self.last_levels)
-
-                    self.lists.append(list_info)
-                    self.transformNode(child)
-                    self.last_levels = self.lists[-1].levels
-                    self.lists.pop()
-
-            elif child.tag == text_prefix + "list-item":
-                paragraph = child.find(text_prefix + "p")
-
-                style = None
-                if paragraph != None:
-                    style_name = paragraph.attrib.get(text_prefix + "style-name", "")
-                    style = self.styles.get(style_name, None)
-
-                identation = 0
-                if style:
-                    identation = style.margin_left
-
-                if not self.lists[-1].levels or self.getLastListLevel().identation < identation:
-                    list_level_info = ListLevelInfo()
-
-                    list_level_style = None
-                    list_info = self.lists[-1]
-                    list_style = self.list_styles.get(list_info.style_name, None)
-                    if list_style:
-                        list_level_style = list_style.levels[len(self.lists[-1].levels)]
-                    elif list_info.style_name == "":
-                        print 'Empty list style. This probably mean uncorrect rst list near: "%s"' % self.getElementText(child)[:20]
-                    else:
-                        print 'Unknown list style: "%s"' % list_info.style_name
+        list_info = ListInfo()
+        list_info.style_name = style_name
+        list_info.levels = list(self.last_levels)
 
-                    # Child list will be of the same kind of the parent list.
-                    if self.lists[-1].style_name in ["rststyle-bulletitem", "rststyle-blockquote-bulletitem"]:
-                        list_level_info.current_index = 0
+        self.lists.append(list_info)
+        self.walkChildren(child, self.endList)
 
-                    elif self.lists[-1].style_name in ["rststyle-enumitem", "rststyle-blockquote-bulletitem"]:
-                        list_level_info.current_index = -1
+    def endList(self):
+        self.last_levels = self.lists[-1].levels
+        self.lists.pop()
 
-                    elif list_level_style and list_level_style.num_format != "":
-                        list_level_info.num_format = list_level_style.num_format
-                        list_level_info.current_index = 0
+    def transformListItem(self, child):
+        paragraph = child.find(text_prefix + "p")
 
-                    else:
-                        list_level_info.current_index = -1
+        identation = 0
+        if paragraph != None:
+            style_name = paragraph.attrib.get(text_prefix + "style-name", "")
+            identation = self.style_resolver.resolve(style_name).margin_left
 
-                    self.lists[-1].levels.append(list_level_info)
+        if not self.lists[-1].levels or self.getLastListLevel().identation < identation:
+            list_level_info = ListLevelInfo()
 
-#                   separator = ""
-#                   if DEBUG_FLAG:
-#                       separator += "prelist"
-#                   separator += "\n"
-#                   self.write(separator)
+            list_level_style = None
+            list_info = self.lists[-1]
+            list_style = self.list_styles.get(list_info.style_name, None)
+            if list_style:
+                list_level_style = list_style.levels[len(self.lists[-1].levels)]
+            elif list_info.style_name == "":
+                print 'Empty list style. This probably mean uncorrect rst list near: "%s"' % self.getElementText(child)[:20]
+            else:
+                print 'Unknown list style: "%s"' % list_info.style_name
 
-                else:
-                    while self.lists[-1].levels and self.getLastListLevel().identation > identation:
-                        self.lists[-1].levels.pop()
+            # Child list will be of the same kind of the parent list.
+            if self.lists[-1].style_name in ["rststyle-bulletitem", "rststyle-blockquote-bulletitem"]:
+                list_level_info.current_index = 0
 
-                    list_level_info = self.lists[-1].levels[-1]
+            elif self.lists[-1].style_name in ["rststyle-enumitem", "rststyle-blockquote-bulletitem"]:
+                list_level_info.current_index = -1
 
-                list_level_info.identation = identation
-                list_level_info.is_bullet_inserted = False # Make sure the first paragraph get its bullet mark.
+            elif list_level_style and list_level_style.num_format != "":
+                list_level_info.num_format = list_level_style.num_format
+                list_level_info.current_index = 0
 
-                # Update the item index of the item:
-                if list_level_info.current_index >= 0:
-                    list_level_info.current_index += 1
+            else:
+                list_level_info.current_index = -1
+
+            self.lists[-1].levels.append(list_level_info)
 
-                self.transformNode(child)
+#           separator = ""
+#           if DEBUG_FLAG:
+#               separator += "prelist"
+#           separator += "\n"
+#           self.write(separator)
+
+        else:
+            while self.lists[-1].levels and self.getLastListLevel().identation > identation:
+                self.lists[-1].levels.pop()
+
+            list_level_info = self.lists[-1].levels[-1]
+
+        list_level_info.identation = identation
+        list_level_info.is_bullet_inserted = False # Make sure the first paragraph get its bullet mark.
+
+        # Update the item index of the item:
+        if list_level_info.current_index >= 0:
+            list_level_info.current_index += 1
+
+        self.walkChildren(child)
+
+    # The handlers converting the elements of the body, keyed by tag or by (tag, style name) which takes precedence.
+    # A handler is called as handler(document, element).
+    element_handlers = {
+        text_prefix + "p": transformParagraph,
+        (text_prefix + "p", "rststyle-title"): transformTitleParagraph,
+        (text_prefix + "p", "rststyle-admon-note-hdr"): transformNoteHeader,
+        (text_prefix + "p", "rststyle-admon-note-body"): transformNoteBody,
+        (text_prefix + "p", "rststyle-admon-warning-hdr"): transformWarningHeader,
+        (text_prefix + "p", "rststyle-admon-warning-body"): transformWarningBody,
+        (text_prefix + "p", "rststyle-blockindent"): transformBlockIndent,
+        (text_prefix + "p", "rststyle-codeblock"): transformCodeBlock,
+        text_prefix + "h": transformHeading,
+        text_prefix + "section": transformSection,
+        text_prefix + "list": transformList,
+        (text_prefix + "list", "Outline"): transformOutlineList,
+        text_prefix + "list-item": transformListItem,
+        table_prefix + "table": transformTableNode,
+    }
+
+    # The handlers returning the text of the elements of a paragraph, keyed like element_handlers.
+    inline_handlers = {
+        text_prefix + "span": getSpanText,
+        drawing_prefix + "frame": getFrameText,
+    }
+
+    # The paragraph elements whose text and children are part of the paragraph text.
+    inline_container_tags = set([text_prefix + "p"])
+
+    @classmethod
+    def registerHandler(cls, tag, handler, style_name = None):
+        "Register handler(document, element) to convert the body elements of the tag (only those of the style when style_name is given)."
+        if "element_handlers" not in cls.__dict__:
+            cls.element_handlers = dict(cls.element_handlers)
+
+        if style_name is None:
+            cls.element_handlers[tag] = handler
+        else:
+            cls.element_handlers[(tag, style_name)] = handler
+
+    @classmethod
+    def registerInlineHandler(cls, tag, handler, style_name = None):
+        "Register handler(document, element), returning the rst text of the element, for the paragraph elements of the tag (only those of the style when style_name is given)."
+        if "inline_handlers" not in cls.__dict__:
+            cls.inline_handlers = dict(cls.inline_handlers)
 
-            elif child.tag == table_prefix + "table":
-                self.transformTableNode(child)
+        if style_name is None:
+            cls.inline_handlers[tag] = handler
+        else:
+            cls.inline_handlers[(tag, style_name)] = handler
 
     def transform(self, content_path, styles_path, picture_dict, options):
+        "Convert the content and styles xml files (paths or file objects) into the rst file."
+        if options.streaming:
+            self.transformStream(content_path, styles_path, picture_dict, options)
+            return
+
         self.picture_dict = picture_dict
         self.options = options
+        self.installElementStats()
 
         styles = {}
         list_styles = {}
 
-        if os.path.isfile(styles_path):
-            parser = xml.etree.ElementTree.XMLTreeBuilder()
-            doc = xml.etree.ElementTree.parse(styles_path, parser)
-            root = doc.getroot()
+        if styles_path and (not isinstance(styles_path, basestring) or os.path.isfile(styles_path)):
+            root = self.parseXml(styles_path)
 
+            self.beginStage("styles")
             styles.update(extractStylesFromRoot(root))
             list_styles.update(extractListStylesFromRoot(root))
+            self.endStage("styles")
 
-        parser = xml.etree.ElementTree.XMLTreeBuilder()
-        doc = xml.etree.ElementTree.parse(content_path, parser)
-        root = doc.getroot()
+        root = self.parseXml(content_path)
 
+        self.beginStage("styles")
         styles.update(extractStylesFromRoot(root))
         list_styles.update(extractListStylesFromRoot(root))
+        self.endStage("styles")
 
         self.styles = styles
         self.list_styles = list_styles
+        self.style_resolver = StyleResolver(styles)
 
 #       f = open("styles.tsn", "w")
 #       for style in styles:
@@ -1078,36 +2295,1163 @@ class RstDocument:
         body = root.find(office_prefix + "body")
         text = body.find(office_prefix + "text")
 
+        self.beginStage("transform")
         self.open()
         self.transformNode(text)
         self.close()
+        self.endStage("transform")
+
+    # The methods a document model may call.
+    model_methods = set(["write", "writeTitle", "writeListParagraph", "writeDefinitionBody", "writeCodeBlock", "writeNoteHeader", "appendToNote",
+        "writeWarningHeader", "appendToWarning", "writeImage", "writeFigure", "writeComment", "writeTableRows"])
+
+    def render(self, model, picture_dict, options):
+        "Write the rst file of the document model with the options."
+        self.model = model
+        self.picture_dict = picture_dict
+        self.options = options
+
+        self.beginStage("render")
+        self.open()
+        for name, args in model.calls:
+            if name not in self.model_methods:
+                raise ValueError('Unknown document model call: "%s"' % name)
+
+            args = [self.resolveText(arg) if isinstance(arg, basestring) else arg for arg in args]
+            getattr(self, name)(*args)
+        self.close()
+        self.endStage("render")
+
+    def transformStream(self, content_path, styles_path, picture_dict, options):
+        "Convert the content xml file block by block while it is parsed. Each top level block is freed once converted so the memory is bounded by the largest block."
+        self.picture_dict = picture_dict
+        self.options = options
+        self.installElementStats()
+
+        self.styles = {}
+        self.list_styles = {}
+        self.style_resolver = StyleResolver(self.styles)
+
+        if styles_path and (not isinstance(styles_path, basestring) or os.path.isfile(styles_path)):
+            root = self.parseXml(styles_path)
+
+            self.beginStage("styles")
+            self.styles.update(extractStylesFromRoot(root))
+            self.list_styles.update(extractListStylesFromRoot(root))
+            self.endStage("styles")
+
+        self.open()
+
+        # The parsing is interleaved with the transform: the parse stage is the time spent in iterparse.
+        content_file = content_path
+        if self.profile:
+            content_file = CountingReader(content_path)
+            self.profile.begin("parse")
+
+        # The parents of the element being parsed:
+        ancestors = []
+        for event, element in iterparseXml(content_file, ("start", "end"), options.xml_backend):
+            if event == "start":
+                ancestors.append(element)
+                continue
+
+            ancestors.pop()
+            if not ancestors:
+                continue
+
+            parent = ancestors[-1]
+            if len(ancestors) == 1 and element.tag in [office_prefix + "automatic-styles", office_prefix + "styles"]:
+                self.beginStage("styles")
+                self.styles.update(extractStylesFromNode(element))
+                self.list_styles.update(extractListStylesFromNode(element))
+                self.style_resolver.clear()
+                parent.remove(element)
+                self.endStage("styles")
+
+            elif parent.tag == office_prefix + "text":
+                self.beginStage("transform")
+                self.transformNode([element])
+                parent.remove(element)
+                self.endStage("transform")
+
+        if self.profile:
+            self.profile.end("parse", content_file.count)
+            content_file.close()
+
+        self.beginStage("transform")
+        self.close()
+        self.endStage("transform")
+
+    def beginStage(self, name):
+        if self.profile:
+            self.profile.begin(name)
+
+    def endStage(self, name, size = 0):
+        if self.profile:
+            self.profile.end(name, size)
+
+    def parseXml(self, source):
+        "Same as parseXml() recording the parse stage in the profile."
+        if not self.profile:
+            return parseXml(source, self.options.xml_backend)
+
+        reader = CountingReader(source)
+        self.profile.begin("parse")
+        try:
+            root = parseXml(reader, self.options.xml_backend)
+        finally:
+            reader.close()
+        self.profile.end("parse", reader.count)
+
+        return root
+
+
+class ModelRecorder(RstDocument):
+    "Convert content.xml into a DocumentModel: the calls writing the rst text are recorded instead of being run."
+    def __init__(self, profile = None):
+        RstDocument.__init__(self, profile = profile)
+        self.model = DocumentModel()
+
+    def record(self, name, *args):
+        self.model.calls.append((name, args))
+
+    def open(self, path = ""):
+        pass
+
+    def close(self):
+        pass
+
+    def getInlineImageText(self, path):
+        self.model.inline_images.append(path)
+        return "\x00%d\x00" % (len(self.model.inline_images) - 1)
+
+    def writeTableSource(self, source):
+        rows = []
+        for header, cells in source.iterRows():
+            rows.append((header, cells))
+        self.record("writeTableRows", rows)
+
+    def write(self, text):
+        self.record("write", text)
+
+    def writeTitle(self, text, level):
+        self.record("writeTitle", text, level)
+
+    def writeListParagraph(self, text, identation, bullet, non_bullet):
+        self.record("writeListParagraph", text, identation, bullet, non_bullet)
+
+    def writeDefinitionBody(self, text):
+        self.record("writeDefinitionBody", text)
+
+    def writeCodeBlock(self, text):
+        self.record("writeCodeBlock", text)
+
+    def writeNoteHeader(self):
+        self.record("writeNoteHeader")
+
+    def appendToNote(self, text):
+        self.record("appendToNote", text)
+
+    def writeWarningHeader(self):
+        self.record("writeWarningHeader")
+
+    def appendToWarning(self, text):
+        self.record("appendToWarning", text)
+
+    def writeImage(self, path):
+        self.record("writeImage", path)
+
+    def writeFigure(self, path, legend):
+        self.record("writeFigure", path, legend)
 
+    def writeComment(self, text):
+        self.record("writeComment", text)
 
-def odt2rst(input_path, output_path, options):
-    odt_pictures_hashes = unpackOdt(input_path, options.temp_folder)
 
-    picture_dict = synchronizeImagesFolders(options.temp_folder, output_path, options.images_relative_folder, odt_pictures_hashes)
+def odt2rstInMemory(input_path, output_path, options, profile = None):
+    "Convert the odt file reading its members straight from the archive so that no temp file is written."
+    odtfile, odt_pictures_sizes = readOdt(input_path, options.referenced_pictures_only, options.xml_backend)
+    try:
+        if profile:
+            profile.begin("images")
+        picture_dict = synchronizeImagesFoldersLocked(None, output_path, options.images_relative_folder, odt_pictures_sizes, odtfile, options.use_manifest, options.hash_algorithm, options.hash_jobs, options.image_naming)
+        if profile:
+            profile.end("images", sum(odt_pictures_sizes.values()))
+
+        content_file = odtfile.open(findOdtMember(odtfile, "content.xml"))
+
+        styles_file = None
+        styles_path = findOdtMember(odtfile, "styles.xml")
+        if styles_path:
+            styles_file = odtfile.open(styles_path)
+
+        rst_document = RstDocument(output_path, profile = profile)
+        rst_document.transform(content_file, styles_file, picture_dict, options)
+    finally:
+        odtfile.close()
+
+
+def odt2rstBytes(odt, output = None, options = None):
+    """Convert the odt given as bytes or as a binary file object without touching the file system.
+    Return the rst text (utf8 encoded) and a dictionary translating the image paths used in the rst text into the image bytes.
+    The rst text is written into the output file object instead when given and None is returned in place of the text."""
+    if options is None:
+        options = Options()
+
+    if not hasattr(odt, "read"):
+        odt = cStringIO.StringIO(odt)
+    elif not hasattr(odt, "seek"):
+        odt = cStringIO.StringIO(odt.read())
+
+    odtfile = zipfile.ZipFile(odt)
+    try:
+        hrefs = None
+        if options.referenced_pictures_only:
+            hrefs = findOdtPictureReferences(odtfile, options.xml_backend)
+
+        picture_dict = {}
+        images = {}
+        for info in odtfile.infolist():
+            if not isOdtPicture(info.filename) or (hrefs is not None and info.filename not in hrefs):
+                continue
+
+            data = odtfile.read(info.filename)
+            picture_name = "picture_%d" % len(picture_dict)
+            if options.image_naming == "hash":
+                picture_name = "picture_" + hashlib.new(options.hash_algorithm, data).hexdigest()
+
+            name, ext = os.path.splitext(info.filename)
+            picture_relative_path = os.path.join(options.images_relative_folder, picture_name) + ext
+            picture_dict[info.filename] = picture_relative_path
+            images[picture_relative_path.replace('\\', '/')] = data
+
+        # The members of an archive opened from a file object share its position so only one of them can be opened at a time.
+        styles_file = None
+        styles_path = findOdtMember(odtfile, "styles.xml")
+        if styles_path:
+            styles_file = cStringIO.StringIO(odtfile.read(styles_path))
+
+        content_file = odtfile.open(findOdtMember(odtfile, "content.xml"))
+
+        text = None
+        if output is None:
+            text = cStringIO.StringIO()
+            rst_document = RstDocument(file = text)
+        else:
+            rst_document = RstDocument(file = output)
+        rst_document.transform(content_file, styles_file, picture_dict, options)
+    finally:
+        odtfile.close()
+
+    if text:
+        text = text.getvalue()
+
+    return text, images
+
+
+def odt2rst(input_path, output_path, options, profile = None):
+    "Convert the odt file into the rst file. The time spent and the bytes processed by each stage are recorded in the profile when given."
+    if options.in_memory:
+        odt2rstInMemory(input_path, output_path, options, profile)
+        return
+
+    if options.model_cache_path:
+        model = getDocumentModel(input_path, options, profile)
+        renderDocumentModel(model, input_path, output_path, options, profile)
+        return
+
+    # Only the xml files are unpacked: the pictures are streamed from the archive straight into the images folder.
+    if profile:
+        profile.begin("unpack")
+    odt_pictures_sizes = unpackOdt(input_path, options.temp_folder, options.referenced_pictures_only, False, options.xml_backend)
 
     content_path = os.path.join(options.temp_folder, "content.xml")
     styles_path = os.path.join(options.temp_folder, "styles.xml")
 
-    rst_document = RstDocument(output_path)
+    if profile:
+        size = 0
+        for path in [content_path, styles_path]:
+            if os.path.isfile(path):
+                size += os.path.getsize(path)
+        profile.end("unpack", size)
+
+        profile.begin("images")
+    odtfile = zipfile.ZipFile(input_path)
+    try:
+        picture_dict = synchronizeImagesFoldersLocked(None, output_path, options.images_relative_folder, odt_pictures_sizes, odtfile, options.use_manifest, options.hash_algorithm, options.hash_jobs, options.image_naming)
+    finally:
+        odtfile.close()
+    if profile:
+        profile.end("images", sum(odt_pictures_sizes.values()))
+
+    rst_document = RstDocument(output_path, profile = profile)
     rst_document.transform(content_path, styles_path, picture_dict, options)
 
     if options.clean:
+        if profile:
+            profile.begin("clean")
         cleanPack(options.temp_folder)
+        if profile:
+            profile.end("clean")
+
+
+def buildDocumentModel(input_path, options, profile = None):
+    "Parse the odt file into a DocumentModel, written by renderDocumentModel() with any output options."
+    odtfile = zipfile.ZipFile(input_path)
+    try:
+        hrefs = findOdtPictureReferences(odtfile, options.xml_backend)
+
+        # Only one member is opened at a time, see odt2rstBytes.
+        styles_file = None
+        styles_path = findOdtMember(odtfile, "styles.xml")
+        if styles_path:
+            styles_file = cStringIO.StringIO(odtfile.read(styles_path))
+
+        content_file = odtfile.open(findOdtMember(odtfile, "content.xml"))
+
+        recorder = ModelRecorder(profile)
+        recorder.transform(content_file, styles_file, {}, options)
+    finally:
+        odtfile.close()
+
+    model = recorder.model
+    for href in hrefs or []:
+        if isOdtPicture(href):
+            model.picture_hrefs.add(href)
+
+    return model
+
+
+def renderDocumentModel(model, input_path, output_path, options, profile = None):
+    "Write the rst file of the document model of the odt file, the pictures being synchronized from the odt file into the images folder of the options."
+    odtfile = zipfile.ZipFile(input_path)
+    try:
+        odt_pictures_sizes = {}
+        for info in odtfile.infolist():
+            if isOdtPicture(info.filename) and (not options.referenced_pictures_only or info.filename in model.picture_hrefs):
+                odt_pictures_sizes[info.filename] = info.file_size
+
+        if profile:
+            profile.begin("images")
+        picture_dict = synchronizeImagesFoldersLocked(None, output_path, options.images_relative_folder, odt_pictures_sizes, odtfile, options.use_manifest, options.hash_algorithm, options.hash_jobs, options.image_naming)
+        if profile:
+            profile.end("images", sum(odt_pictures_sizes.values()))
+    finally:
+        odtfile.close()
+
+    rst_document = RstDocument(output_path, profile = profile)
+    rst_document.render(model, picture_dict, options)
+
+
+MODEL_CACHE_HEADER = "odt2rst-model %d\n" % MODEL_VERSION
+
+
+class ModelCache:
+    """Keep the document models in a folder, keyed by the hash of the odt file content and of the converter code, so that a document is rendered again without being parsed.
+    The models are stored marshaled and compressed. The least recently used ones are removed once the folder exceeds max_size bytes."""
+    def __init__(self, folder, max_size = 256 * 1024 * 1024, algorithm = "md5"):
+        self.folder = folder
+        self.max_size = max_size
+        self.algorithm = algorithm
+
+    def getKey(self, input_path):
+        "Return the hash of the odt file content and of the converter code: the model records rendered fragments, any change of the code makes it stale."
+        h = hashlib.new(self.algorithm)
+        h.update(hashFile(open(input_path, "rb"), self.algorithm))
+        h.update("\nversion=%s %s" % (VERSION, CODE_FINGERPRINT))
+
+        return h.hexdigest()
+
+    def getPath(self, key):
+        return os.path.join(self.folder, key + ".model")
+
+    def load(self, key):
+        "Return the model of the key or None when it is not cached (or corrupt or of an other model version)."
+        path = self.getPath(key)
+        if not os.path.isfile(path):
+            return None
+
+        try:
+            f = open(path, "rb")
+            try:
+                if f.readline() != MODEL_CACHE_HEADER:
+                    return None
+                calls, inline_images, picture_hrefs = marshal.loads(zlib.decompress(f.read()))
+            finally:
+                f.close()
+
+            # Mark the model as recently used.
+            os.utime(path, None)
+        except (IOError, OSError, EOFError, ValueError, TypeError, zlib.error):
+            return None
+
+        model = DocumentModel()
+        model.calls = calls
+        model.inline_images = inline_images
+        model.picture_hrefs = picture_hrefs
+        return model
+
+    def save(self, key, model):
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+
+        data = zlib.compress(marshal.dumps((model.calls, model.inline_images, model.picture_hrefs)))
+
+        # Several processes may save the same model: each one writes its own temp file.
+        fd, tmp_path = tempfile.mkstemp(".tmp", key, self.folder)
+        f = os.fdopen(fd, "wb")
+        try:
+            f.write(MODEL_CACHE_HEADER)
+            f.write(data)
+        finally:
+            f.close()
+
+        path = self.getPath(key)
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp_path, path)
+
+        self.evict()
+
+    def evict(self):
+        "Remove the least recently used models until the folder size is below max_size."
+        entries = []
+        total_size = 0
+        for name in os.listdir(self.folder):
+            if not name.endswith(".model"):
+                continue
+
+            try:
+                stat = os.stat(os.path.join(self.folder, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total_size += stat.st_size
+
+        entries.sort()
+        for mtime, size, name in entries:
+            if total_size <= self.max_size:
+                break
+
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except OSError:
+                # An other process removed it first.
+                pass
+            total_size -= size
+
+
+def getDocumentModel(input_path, options, profile = None):
+    "Return the model of the odt file, taken from the model cache of the options when possible."
+    if not options.model_cache_path:
+        return buildDocumentModel(input_path, options, profile)
+
+    model_cache = ModelCache(options.model_cache_path, options.model_cache_size, options.hash_algorithm)
+
+    if profile:
+        profile.begin("model_cache")
+    key = model_cache.getKey(input_path)
+    model = model_cache.load(key)
+    if profile:
+        profile.end("model_cache")
+
+    if model is None:
+        model = buildDocumentModel(input_path, options, profile)
+
+        if profile:
+            profile.begin("model_cache")
+        model_cache.save(key, model)
+        if profile:
+            profile.end("model_cache")
+
+    return model
+
+
+def odt2rstVariants(input_path, variants, options, profile = None):
+    "Convert the odt file into several rst files, variants being a list of (output path, options) tuples. The odt file is parsed only once, with options."
+    model = getDocumentModel(input_path, options, profile)
+    for output_path, variant_options in variants:
+        renderDocumentModel(model, input_path, output_path, variant_options, profile)
+
+
+def parseVariant(text, options):
+    """Return the (output path, options) of a variant given as "output-path,name=value,...".
+    The names are those of the command line options (wrap-width, images, table-format...) or of the Options fields, the other fields are those of options."""
+    fields = text.split(",")
+    output_path = fields[0]
+
+    variant_options = copy.copy(options)
+    for field in fields[1:]:
+        name, separator, value = field.partition("=")
+        name = {"images": "images_relative_folder", "temp": "temp_folder"}.get(name, name.replace("-", "_"))
+        if not separator or name.startswith("_") or not hasattr(options, name):
+            raise ValueError('Unknown variant option: "%s"' % field)
+
+        current = getattr(options, name)
+        if isinstance(current, bool):
+            value = value.lower() in ["1", "true", "yes"]
+        elif isinstance(current, int):
+            value = int(value)
+        checkOptionValue(name, value)
+        setattr(variant_options, name, value)
+
+    return output_path, variant_options
+
+
+class BuildCache:
+    "Remember, for each converted odt file, a key made of its content hash, the options affecting the output and the tool version so that an unchanged document is not converted again."
+    # The Options fields changing the rst output.
+    option_names = ["wrap_width", "images_relative_folder", "table_format", "compact_table_rows", "image_naming", "hash_algorithm", "referenced_pictures_only"]
+
+    def __init__(self, path):
+        self.path = path
+
+        # Translate an absolute input path into a (key, absolute output path) tuple.
+        self.entries = {}
+        self.modified = False
+
+    def load(self):
+        "Read the cache. A missing or corrupt cache is rebuilt from scratch."
+        self.entries = {}
+        self.modified = False
+
+        if not os.path.isfile(self.path):
+            return
+
+        try:
+            f = open(self.path, "rb")
+            try:
+                data = json.load(f)
+            finally:
+                f.close()
+
+            if data.get("version") != VERSION:
+                raise ValueError("cache of an other version")
+
+            for input_path in data["entries"]:
+                key, output_path = data["entries"][input_path]
+                self.entries[input_path] = (key, output_path)
+
+        except (ValueError, TypeError, KeyError, AttributeError):
+            self.entries = {}
+            self.modified = True
+
+    def save(self):
+        if not self.modified:
+            return
+
+        temp_path = self.path + ".tmp"
+        f = open(temp_path, "wb")
+        json.dump({"version": VERSION, "entries": self.entries}, f, indent = 0, sort_keys = True)
+        f.close()
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(temp_path, self.path)
+
+        self.modified = False
+
+    def getKey(self, input_path, options):
+        h = hashlib.new(options.hash_algorithm)
+        h.update(hashFile(open(input_path, "rb"), options.hash_algorithm))
+        for name in self.option_names:
+            h.update("\n%s=%r" % (name, getattr(options, name)))
+        h.update("\nversion=%s %s" % (VERSION, CODE_FINGERPRINT))
+
+        return h.hexdigest()
+
+    def isUpToDate(self, input_path, output_path, key):
+        "Return True when the output has been generated from the same input with the same options and is still there."
+        entry = self.entries.get(os.path.abspath(input_path), None)
+        if not entry:
+            return False
+
+        return entry[0] == key and entry[1] == os.path.abspath(output_path) and os.path.isfile(output_path)
+
+    def update(self, input_path, output_path, key):
+        self.entries[os.path.abspath(input_path)] = (key, os.path.abspath(output_path))
+        self.modified = True
+
+    def prune(self):
+        "Forget the inputs which do not exist anymore."
+        for input_path in self.entries.keys():
+            if not os.path.isfile(input_path):
+                del self.entries[input_path]
+                self.modified = True
+
+
+def odt2rstIfChanged(input_path, output_path, options):
+    "Same as odt2rst but the conversion is skipped when the build cache of the options knows the document is unchanged. Return True when the document has been converted."
+    profile = None
+    if options.profile_path or options.element_stats:
+        profile = Profile(input_path, output_path, options.element_stats)
+
+    converted = True
+    if not options.cache_path:
+        odt2rst(input_path, output_path, options, profile)
+
+    else:
+        cache = BuildCache(options.cache_path)
+        cache.load()
+        cache.prune()
+
+        converted = False
+        key = cache.getKey(input_path, options)
+        if not cache.isUpToDate(input_path, output_path, key):
+            odt2rst(input_path, output_path, options, profile)
+            cache.update(input_path, output_path, key)
+            converted = True
+
+        cache.save()
+
+    if options.profile_path and converted:
+        saveProfiles(options.profile_path, [profile.getRecord()])
+
+    if options.element_stats and converted:
+        print profile.elements.getReport()
+
+    return converted
+
+
+def findOdtFiles(source_folder):
+    "Return the paths, relative to the source folder, of the .odt files found in the source folder tree."
+    ret = []
+    for folder, folder_names, names in os.walk(source_folder):
+        folder_names.sort()
+        for name in sorted(names):
+            if os.path.splitext(name)[1].lower() == ".odt":
+                ret.append(os.path.relpath(os.path.join(folder, name), source_folder))
+
+    return ret
+
+
+def initBatchWorker(images_lock, quiet = False):
+    global IMAGES_LOCK
+    IMAGES_LOCK = images_lock
+
+    # The server responses are written on stdout: the conversions messages go to stderr.
+    if quiet:
+        sys.stdout = sys.stderr
+
+
+def makeFolders(folder):
+    "Create the folder and its missing parents, the folder may be created concurrently by an other worker."
+    if folder and not os.path.isdir(folder):
+        try:
+            os.makedirs(folder)
+        except OSError:
+            # An other worker may have created it in the meantime.
+            if not os.path.isdir(folder):
+                raise
+
+
+def convertBatchJob(job):
+    "Convert one document of a batch and return (input_path, output_path, error, elapsed, profile record or None). Errors are reported instead of raised so that a bad document does not abort the batch."
+    input_path, output_path, options = job
+
+    start = time.time()
+    error = ""
+    profile = None
+    if options.profile_path or options.element_stats:
+        profile = Profile(input_path, output_path, options.element_stats)
+    try:
+        makeFolders(os.path.dirname(output_path))
+
+        # Each job needs its own temp folder as the workers unpack their documents concurrently.
+        job_options = copy.copy(options)
+        if not options.in_memory:
+            makeFolders(options.temp_folder)
+            job_options.temp_folder = tempfile.mkdtemp(prefix="odt2rst-", dir=options.temp_folder)
+
+        try:
+            odt2rst(input_path, output_path, job_options, profile)
+        finally:
+            if not options.in_memory and options.clean:
+                shutil.rmtree(job_options.temp_folder, True)
+
+    except Exception, e:
+        error = "%s: %s" % (e.__class__.__name__, e)
+
+    record = None
+    if profile and not error:
+        record = profile.getRecord()
+
+    return input_path, output_path, error, time.time() - start, record
+
+
+def batchOdt2rst(source_folder, destination_folder, options, jobs = 0):
+    "Convert all the .odt files of the source folder tree into the mirrored destination folder tree using a pool of jobs processes. Return the number of failed documents."
+    cache = None
+    if options.cache_path:
+        cache = BuildCache(options.cache_path)
+        cache.load()
+        cache.prune()
+
+    batch_jobs = []
+    keys = {}
+    num_skipped = 0
+    for relative_path in findOdtFiles(source_folder):
+        name, ext = os.path.splitext(relative_path)
+        input_path = os.path.join(source_folder, relative_path)
+        output_path = os.path.join(destination_folder, name + ".rst")
+
+        if cache:
+            keys[input_path] = cache.getKey(input_path, options)
+            if cache.isUpToDate(input_path, output_path, keys[input_path]):
+                num_skipped += 1
+                continue
+
+        batch_jobs.append((input_path, output_path, options))
+
+    if jobs <= 0:
+        jobs = multiprocessing.cpu_count()
+
+    start = time.time()
+    num_failures = 0
+    input_size = 0
+    records = []
+
+    pool = multiprocessing.Pool(jobs, initBatchWorker, (multiprocessing.Lock(),))
+    try:
+        for input_path, output_path, error, elapsed, record in pool.imap_unordered(convertBatchJob, batch_jobs):
+            input_size += os.path.getsize(input_path)
+            if record:
+                records.append(record)
+            if error:
+                num_failures += 1
+                print "FAIL %s: %s" % (input_path, error)
+            else:
+                print "OK   %s -> %s (%.2fs)" % (input_path, output_path, elapsed)
+                if cache:
+                    cache.update(input_path, output_path, keys[input_path])
+            sys.stdout.flush()
+    finally:
+        pool.close()
+        pool.join()
+
+        if cache:
+            cache.save()
+
+        if options.profile_path:
+            saveProfiles(options.profile_path, records)
+
+    if options.element_stats:
+        element_stats = ElementStats()
+        for record in records:
+            element_stats.merge(record["elements"])
+        print element_stats.getReport()
+
+    elapsed = max(time.time() - start, 1e-6)
+    print "%d documents converted, %d failed, %d unchanged in %.2fs (%.1f documents/s, %.2f MB/s)" % (
+        len(batch_jobs) - num_failures, num_failures, num_skipped, elapsed, len(batch_jobs) / elapsed, input_size / elapsed / (1024 * 1024))
+
+    return num_failures
+
+
+def getJobOptions(options, overrides):
+    "Return a copy of the options with the fields given in the overrides dictionary replaced."
+    job_options = copy.copy(options)
+    for name in overrides:
+        if name.startswith("_") or not hasattr(options, name):
+            raise ValueError('Unknown option: "%s"' % name)
+
+        value = overrides[name]
+        if isinstance(value, unicode):
+            value = value.encode("utf8")
+
+        # The json integers are accepted for the integer fields, the other values must have the type of the field.
+        current = getattr(options, name)
+        if type(value) != type(current) and not (type(current) in [int, long] and type(value) in [int, long]):
+            raise ValueError('Invalid value for the option "%s": %s' % (name, json.dumps(overrides[name])))
+        checkOptionValue(name, value)
+
+        setattr(job_options, str(name), value)
+
+    return job_options
+
+
+class JsonLineWriter:
+    "Write json lines into a file from any thread and wait until all the expected lines are written."
+    def __init__(self, file):
+        self.file = file
+        self.condition = threading.Condition()
+        self.pending = 0
+
+    def expect(self):
+        self.condition.acquire()
+        self.pending += 1
+        self.condition.release()
+
+    def write(self, response):
+        self.condition.acquire()
+        try:
+            try:
+                self.file.write(json.dumps(response, sort_keys = True) + "\n")
+                self.file.flush()
+            except (IOError, socket.error):
+                # The client is gone, the response is dropped.
+                pass
+            self.pending -= 1
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+    def wait(self):
+        self.condition.acquire()
+        while self.pending:
+            self.condition.wait(1)
+        self.condition.release()
+
+
+class ConversionServer:
+    """Run the conversion jobs received as json lines through a pool of worker processes started once.
+    A job is {"input": odt path, "output": rst path (optional), "options": {Options field: value} (optional), "id": any value (optional)}.
+    Its response is {"id", "input", "output", "status": "ok", "error" or "unchanged", "error", "elapsed", "total", "profile" (with the profile_path option)}."""
+    def __init__(self, options, jobs = 0):
+        self.options = options
+
+        if jobs <= 0:
+            jobs = multiprocessing.cpu_count()
+        self.pool = multiprocessing.Pool(jobs, initBatchWorker, (multiprocessing.Lock(), True))
+
+        # The build cache is kept loaded and only used by the server process.
+        self.cache = None
+        self.cache_lock = threading.Lock()
+        if options.cache_path:
+            self.cache = BuildCache(options.cache_path)
+            self.cache.load()
+            self.cache.prune()
+
+    def submit(self, line, writer):
+        "Start the job of the json line. Its response is written by the writer once the job is done."
+        line = line.strip()
+        if not line:
+            return
+
+        start = time.time()
+        writer.expect()
+
+        # Only a json object is taken as the request, the error responses are built from it.
+        request = {}
+        answered = False
+        try:
+            try:
+                self.startJob(line, request, start, writer)
+                answered = True
+            except Exception, e:
+                writer.write(self.getResponse(request, request.get("input"), request.get("output"), "error", "%s: %s" % (e.__class__.__name__, e), 0.0, start))
+                answered = True
+        finally:
+            # The writer waits for one response per expected job: it is written whatever failed.
+            if not answered:
+                writer.write(self.getResponse({}, None, None, "error", "Internal error", 0.0, start))
+
+    def startJob(self, line, request, start, writer):
+        "Parse the job line into the request dictionary, then write the unchanged response or run the job through the pool."
+        job_request = json.loads(line)
+        if not isinstance(job_request, dict):
+            raise ValueError("A job must be a json object")
+        request.update(job_request)
+
+        input_path = request["input"].encode("utf8")
+        output_path = request.get("output")
+        if output_path:
+            output_path = output_path.encode("utf8")
+        else:
+            output_path = os.path.splitext(input_path)[0] + ".rst"
+        options = getJobOptions(self.options, request.get("options", {}))
+
+        key = None
+        if self.cache and options.cache_path == self.options.cache_path:
+            self.cache_lock.acquire()
+            try:
+                key = self.cache.getKey(input_path, options)
+                up_to_date = self.cache.isUpToDate(input_path, output_path, key)
+            finally:
+                self.cache_lock.release()
+
+            if up_to_date:
+                writer.write(self.getResponse(request, input_path, output_path, "unchanged", "", 0.0, start))
+                return
+
+        job = (input_path, output_path, options)
+        callback = lambda result: self.complete(request, key, result, start, writer)
+        self.pool.apply_async(convertBatchJob, (job,), callback = callback)
+
+    def complete(self, request, key, result, start, writer):
+        input_path, output_path, error, elapsed, record = result
+
+        status = "ok"
+        if error:
+            status = "error"
+        elif key:
+            self.cache_lock.acquire()
+            try:
+                self.cache.update(input_path, output_path, key)
+                self.cache.save()
+            except (IOError, OSError), e:
+                # The response must be written anyway, the writer waits for it.
+                status = "error"
+                error = "Cannot save the build cache: %s" % e
+            finally:
+                self.cache_lock.release()
+
+        response = self.getResponse(request, input_path, output_path, status, error, elapsed, start)
+        if record:
+            response["profile"] = record
+        writer.write(response)
+
+    def getResponse(self, request, input_path, output_path, status, error, elapsed, start):
+        "Return the response of a job: elapsed is the conversion time, total includes the time the job waited for a worker."
+        return {
+            "id": request.get("id"),
+            "input": input_path,
+            "output": output_path,
+            "status": status,
+            "error": error,
+            "elapsed": elapsed,
+            "total": time.time() - start}
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+
+class ConversionRequestHandler(SocketServer.StreamRequestHandler):
+    "Read the jobs of a socket connection and write their responses back once they are all done."
+    def handle(self):
+        writer = JsonLineWriter(self.wfile)
+        try:
+            for line in self.rfile:
+                self.server.conversion_server.submit(line, writer)
+        finally:
+            writer.wait()
+
+
+class ConversionSocketServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+def stopServer(signal_number, frame):
+    sys.exit(0)
+
+
+def serveOdt2rst(options, jobs = 0, socket_path = ""):
+    "Convert the jobs read as json lines from the unix socket at socket_path, or from stdin when empty, until the end of the input (or an interruption or termination)."
+    conversion_server = ConversionServer(options, jobs)
+    try:
+        if not socket_path:
+            writer = JsonLineWriter(sys.stdout)
+            try:
+                # readline() as iterating over stdin would wait for several lines.
+                for line in iter(sys.stdin.readline, ""):
+                    conversion_server.submit(line, writer)
+            finally:
+                writer.wait()
+            return
+
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+        server = ConversionSocketServer(socket_path, ConversionRequestHandler)
+        server.conversion_server = conversion_server
+        signal.signal(signal.SIGTERM, stopServer)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.remove(socket_path)
+
+    finally:
+        conversion_server.close()
+
+
+class OdtWatcher:
+    """Report the .odt files of a folder tree whose signature (size and mtime) changed.
+    The tree is listed every interval seconds or, when pyinotify is available, only the files of the events are checked."""
+    def __init__(self, source_folder, interval = 1.0):
+        self.source_folder = source_folder
+        self.interval = interval
+
+        # Translate the .odt file paths, relative to the source folder, into their signature.
+        self.signatures = self.scan()
+
+        self.notifier = None
+        self.event_paths = set()
+        self.rescan = False
+        if pyinotify:
+            manager = pyinotify.WatchManager()
+            mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO | pyinotify.IN_MOVED_FROM | pyinotify.IN_DELETE | pyinotify.IN_CREATE
+            self.notifier = pyinotify.Notifier(manager, self.onEvent, timeout = int(interval * 1000))
+            manager.add_watch(source_folder, mask, rec = True, auto_add = True)
+
+    def onEvent(self, event):
+        if event.dir:
+            # The files of a folder moved into the tree come without events.
+            self.rescan = True
+        else:
+            self.event_paths.add(event.pathname)
+
+    def scan(self):
+        signatures = {}
+        for relative_path in findOdtFiles(self.source_folder):
+            signature = getFileSignature(os.path.join(self.source_folder, relative_path))
+            if signature:
+                signatures[relative_path] = signature
+
+        return signatures
+
+    def wait(self):
+        "Wait up to interval seconds and return the (changed, removed) lists of the .odt files relative paths."
+        if not self.notifier:
+            time.sleep(self.interval)
+            signatures = self.scan()
+
+        else:
+            if self.notifier.check_events():
+                self.notifier.read_events()
+                self.notifier.process_events()
+
+            if self.rescan:
+                signatures = self.scan()
+            else:
+                signatures = dict(self.signatures)
+                for path in self.event_paths:
+                    relative_path = os.path.relpath(path, self.source_folder)
+                    if os.path.splitext(relative_path)[1].lower() != ".odt":
+                        continue
+
+                    signature = getFileSignature(path)
+                    if signature:
+                        signatures[relative_path] = signature
+                    elif relative_path in signatures:
+                        del signatures[relative_path]
+
+            self.event_paths = set()
+            self.rescan = False
+
+        changed = [path for path in signatures if signatures[path] != self.signatures.get(path, None)]
+        removed = [path for path in self.signatures if path not in signatures]
+        self.signatures = signatures
+        return changed, removed
+
+    def close(self):
+        if self.notifier:
+            self.notifier.stop()
+
+
+def watchOdt2rst(source_folder, destination_folder, options, jobs = 0, interval = 1.0, debounce = 0.5):
+    """Convert the .odt files of the source folder tree into the mirrored destination folder tree each time they change, until interrupted.
+    A file is converted once it has not changed for debounce seconds, so that a burst of saves makes a single conversion."""
+    global IMAGES_LOCK, WARM_MANIFESTS
+
+    # The workers are threads of this process: the images manifests stay loaded between the conversions.
+    IMAGES_LOCK = threading.Lock()
+    WARM_MANIFESTS = {}
+
+    if jobs <= 0:
+        jobs = min(4, multiprocessing.cpu_count())
+
+    watcher = OdtWatcher(source_folder, interval)
+
+    def getOutputPath(relative_path):
+        name, ext = os.path.splitext(relative_path)
+        return os.path.join(destination_folder, name + ".rst")
+
+    # Translate the relative paths of the files to convert into the time of their last change.
+    # The files whose rst file is missing or older are converted first.
+    pending = {}
+    for relative_path in watcher.signatures:
+        output_signature = getFileSignature(getOutputPath(relative_path))
+        if not output_signature or output_signature[1] < watcher.signatures[relative_path][1]:
+            pending[relative_path] = 0.0
+
+    converting = set()
+    results = Queue.Queue()
+    records = []
+
+    def printResults():
+        while True:
+            try:
+                input_path, output_path, error, elapsed, record = results.get_nowait()
+            except Queue.Empty:
+                return
+
+            converting.discard(input_path)
+            if record:
+                records.append(record)
+            if error:
+                print "FAIL %s: %s" % (input_path, error)
+            else:
+                print "OK   %s -> %s (%.2fs)" % (input_path, output_path, elapsed)
+            sys.stdout.flush()
+
+    if watcher.notifier:
+        print "Watching %s with inotify (%d jobs)" % (source_folder, jobs)
+    else:
+        print "Watching %s every %gs (%d jobs)" % (source_folder, interval, jobs)
+    sys.stdout.flush()
+
+    pool = multiprocessing.pool.ThreadPool(jobs)
+    signal.signal(signal.SIGTERM, stopServer)
+    try:
+        while True:
+            printResults()
+
+            now = time.time()
+            for relative_path in sorted(pending):
+                input_path = os.path.join(source_folder, relative_path)
+                # A file changed while it is converted is converted again afterwards.
+                if input_path in converting or now - pending[relative_path] < debounce:
+                    continue
+
+                del pending[relative_path]
+                converting.add(input_path)
+                pool.apply_async(convertBatchJob, ((input_path, getOutputPath(relative_path), options),), callback = results.put)
+
+            changed, removed = watcher.wait()
+            now = time.time()
+            for relative_path in changed:
+                pending[relative_path] = now
+            for relative_path in removed:
+                if relative_path in pending:
+                    del pending[relative_path]
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        watcher.close()
+        pool.close()
+        pool.join()
+        printResults()
+
+        if options.profile_path:
+            saveProfiles(options.profile_path, records)
+
+        if options.element_stats:
+            element_stats = ElementStats()
+            for record in records:
+                element_stats.merge(record["elements"])
+            print element_stats.getReport()
 
 
 def version():
-    print "1.0"
+    print VERSION
 
 
 def help():
-    print "odt2rst.py [--images images-folder] [--temp temp-folder] [--wrap-width width] odtfile [rstfile]"
+    print "odt2rst.py [--images images-folder] [--temp temp-folder] [--wrap-width width] [--in-memory] [--streaming] [--stream-tables] [--table-format grid|list|csv|auto] [--compact-table-rows n] [--no-manifest] [--hash-algorithm name] [--hash-jobs n] [--image-naming sequential|hash] [--all-pictures] [--cache cache-file] [--model-cache folder] [--model-cache-size megabytes] [--buffer-size size] [--profile json-file] [--stats] [--xml-backend auto|lxml|celementtree|elementtree] odtfile [rstfile]"
+    print "odt2rst.py --batch [--jobs n] [options] source-folder destination-folder"
+    print "odt2rst.py --serve [--socket socket-path] [--jobs n] [options]"
+    print "odt2rst.py --watch source-folder [--jobs n] [--interval seconds] [--debounce seconds] [options] [destination-folder]"
+    print "odt2rst.py [options] odtfile [rstfile] --variant rstfile,wrap-width=width,images=images-folder,... [--variant ...]"
 
 
 def main():
-    opts, args = getopt.getopt(sys.argv[1:], "vh", ["version", "help", "do-not-clean", "images=", "temp=", "wrap-width="])
+    opts, args = getopt.gnu_getopt(sys.argv[1:], "vh", ["version", "help", "do-not-clean", "images=", "temp=", "wrap-width=", "in-memory", "streaming", "stream-tables", "table-format=", "compact-table-rows=", "no-manifest", "hash-algorithm=", "hash-jobs=", "image-naming=", "all-pictures", "cache=", "model-cache=", "model-cache-size=", "buffer-size=", "profile=", "stats", "xml-backend=", "batch", "jobs=", "serve", "socket=", "watch=", "interval=", "debounce=", "variant="])
     
     options = Options()
     
@@ -1115,6 +3459,14 @@ def main():
     temp_folder = "."
     clean = True
     wrap_width = -1
+    batch = False
+    jobs = 0
+    serve = False
+    socket_path = ""
+    watch_folder = ""
+    interval = 1.0
+    debounce = 0.5
+    variant_texts = []
     for o, v in opts:
         if o in ["-v", "--version"]:
             version()
@@ -1139,6 +3491,127 @@ def main():
             #clean = False
             options.clean = False
 
+        if o in ["--in-memory"]:
+            options.in_memory = True
+
+        if o in ["--streaming"]:
+            options.streaming = True
+
+        if o in ["--stream-tables"]:
+            options.stream_tables = True
+
+        if o in ["--table-format"]:
+            try:
+                checkOptionValue("table_format", v)
+            except ValueError, e:
+                print e
+                return
+            options.table_format = v
+
+        if o in ["--compact-table-rows"]:
+            options.compact_table_rows = int(v)
+
+        if o in ["--no-manifest"]:
+            options.use_manifest = False
+
+        if o in ["--hash-algorithm"]:
+            try:
+                checkOptionValue("hash_algorithm", v)
+            except ValueError, e:
+                print e
+                return
+            options.hash_algorithm = v
+
+        if o in ["--hash-jobs"]:
+            options.hash_jobs = int(v)
+
+        if o in ["--image-naming"]:
+            try:
+                checkOptionValue("image_naming", v)
+            except ValueError, e:
+                print e
+                return
+            options.image_naming = v
+
+        if o in ["--all-pictures"]:
+            options.referenced_pictures_only = False
+
+        if o in ["--cache"]:
+            options.cache_path = v
+
+        if o in ["--model-cache"]:
+            options.model_cache_path = v
+
+        if o in ["--model-cache-size"]:
+            options.model_cache_size = int(v) * 1024 * 1024
+
+        if o in ["--buffer-size"]:
+            options.buffer_size = int(v)
+
+        if o in ["--profile"]:
+            options.profile_path = v
+
+        if o in ["--stats"]:
+            options.element_stats = True
+
+        if o in ["--xml-backend"]:
+            try:
+                checkOptionValue("xml_backend", v)
+            except ValueError, e:
+                print e
+                return
+            options.xml_backend = v
+
+        if o in ["--batch"]:
+            batch = True
+
+        if o in ["--jobs"]:
+            jobs = int(v)
+
+        if o in ["--serve"]:
+            serve = True
+
+        if o in ["--socket"]:
+            serve = True
+            socket_path = v
+
+        if o in ["--watch"]:
+            watch_folder = v
+
+        if o in ["--interval"]:
+            interval = float(v)
+
+        if o in ["--debounce"]:
+            debounce = float(v)
+
+        if o in ["--variant"]:
+            variant_texts.append(v)
+
+    if serve:
+        serveOdt2rst(options, jobs, socket_path)
+        return
+
+    if watch_folder:
+        if len(args) > 1:
+            help()
+            return
+
+        destination_folder = watch_folder
+        if args:
+            destination_folder = args[0]
+
+        watchOdt2rst(watch_folder, destination_folder, options, jobs, interval, debounce)
+        return
+
+    if batch:
+        if len(args) != 2:
+            help()
+            return
+
+        if batchOdt2rst(args[0], args[1], options, jobs):
+            sys.exit(1)
+        return
+
     input_file = ""
     if len(args) >= 1:
         input_file = args[0]
@@ -1157,7 +3630,28 @@ def main():
 #   print "temp:", temp_folder
 #   print "images:", images_relative_folder
 
-    odt2rst(input_file, output_file, options)
+    if variant_texts:
+        variants = [(output_file, options)]
+        for text in variant_texts:
+            try:
+                variants.append(parseVariant(text, options))
+            except ValueError, e:
+                print e
+                return
+
+        profile = None
+        if options.profile_path or options.element_stats:
+            profile = Profile(input_file, output_file, options.element_stats)
+
+        odt2rstVariants(input_file, variants, options, profile)
+
+        if options.profile_path:
+            saveProfiles(options.profile_path, [profile.getRecord()])
+        if options.element_stats:
+            print profile.elements.getReport()
+        return
+
+    odt2rstIfChanged(input_file, output_file, options)
 
 
 if __name__ == "__main__":